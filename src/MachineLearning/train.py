@@ -2,6 +2,12 @@ import cv2
 import numpy as np
 import sklearn.neighbors as nb
 import pickle
+import sys
+from os import path
+
+# The compact model format lives with the rest of the source code
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), ".."))
+from digitModel import save_model
 
 IMG_COUNT = 756
 X = []
@@ -21,13 +27,22 @@ for i in range(IMG_COUNT):
 # Converting the lists to numpy arrays
 Y = np.array(Y)
 X = np.array(X)
+IMG_SIZE = X.shape[1:]
 # Reshaping each image to be 1-dimensional
 X = np.reshape(X, (IMG_COUNT, X.shape[1] * X.shape[2]))
 
-# Training using k-nearest neighbors algorithm
-knc = nb.KNeighborsClassifier()
-knc.fit(X, Y)
+# Passing --compact writes the compact model, which is memory-mapped
+# by the program instead of unpickling a KNeighborsClassifier
+if "--compact" in sys.argv:
+    save_model("../CTR_digits.bin", X, Y, height=IMG_SIZE[0], width=IMG_SIZE[1])
+
+else:
+    # Training using k-nearest neighbors algorithm
+    knc = nb.KNeighborsClassifier()
+    knc.fit(X, Y)
+    # Labels of the training digits, used to vote with the neighbors found by the program
+    knc.training_labels = Y
 
-# Saving the model
-with open("../CTR_digits.knn", 'wb') as file:
-    pickle.dump(knc, file)
\ No newline at end of file
+    # Saving the model
+    with open("../CTR_digits.knn", 'wb') as file:
+        pickle.dump(knc, file)
\ No newline at end of file
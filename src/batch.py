@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from cropDetection import *
+from instrumentation import *
+from videoProcessing import *
+
+# Extensions of the video files picked up from a directory
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".flv", ".webm", ".ts")
+
+
+def parse_arguments():
+    ''' Parses the command line arguments of the batch processing. '''
+
+    parser = argparse.ArgumentParser(description="Finds the in game time of many Crash Team Racing speedruns, without any user interface.")
+    parser.add_argument("videos", nargs="*", help="speedrun videos, or directories containing them")
+    parser.add_argument("--manifest", help="JSON file with a list of runs, each one with a video and optionally its crop, version, category, races and max_spacing")
+    parser.add_argument("--crop", type=int, nargs=4, metavar=("H1", "H2", "W1", "W2"), help="crop of the game in the videos, detected automatically if not given")
+    parser.add_argument("--version", default="auto", help="game region: " + ", ".join(VERSIONS) + ", or auto to detect it on the first race")
+    parser.add_argument("--category", default=CATEGORIES[0], help="run category: " + ", ".join(CATEGORIES).replace("%", "%%"))
+    parser.add_argument("--races", type=int, help="number of races of the runs, replacing the one of the category")
+    parser.add_argument("--max-spacing", type=int, help="number of frames without a race after which a run is considered over")
+    parser.add_argument("--output", help="directory where the JSON result of each run is written, printed to the terminal if not given")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of runs processed at the same time")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes scanning each video")
+    parser.add_argument("--queue-depth", type=int, default=0, help="number of frames decoded ahead in a separate thread")
+    parser.add_argument("--stride", type=int, default=SAMPLE_STRIDE, help="frames between the samples of the coarse to fine search, 1 checks every frame")
+    parser.add_argument("--recognition-threads", type=int, default=1, help="number of threads reading the races while the scan goes on, 0 reads each race before scanning again")
+    parser.add_argument("--no-realign", action="store_true", help="don't read again the races whose digits are far from the model with their own alignment")
+    parser.add_argument("--ffmpeg", action="store_true", help="decode the videos with ffmpeg straight to the size of the game, if it is installed")
+    parser.add_argument("--no-cache", action="store_true", help="always scan the videos, without reading or writing the result cache")
+    parser.add_argument("--profile", action="store_true", help="add a summary of the counters and timings of the pipeline to each result")
+    parser.add_argument("--no-checkpoint", action="store_true", help="don't checkpoint the scans to resume interrupted runs")
+
+    return parser.parse_args()
+
+
+def option_index(value, options):
+    ''' Gets the index of a version or category, given by its name or index.
+        "auto" and None give None, to detect the option automatically.
+        @param value: name or index of the option.
+        @param options: VERSIONS or CATEGORIES. '''
+
+    if value is None or value == "auto":
+        return None
+    if isinstance(value, int):
+        return value
+    if value.isdigit():
+        return int(value)
+    for i in range(len(options)):
+        if value.lower() == options[i].lower():
+            return i
+    raise ValueError("Unknown option " + value + ", expected one of: " + ", ".join(options))
+
+
+def run_category(category, races=None, max_spacing=None):
+    ''' Gets the category of a run, with custom settings if any is given.
+        @param category: index of the category.
+        @param races: number of races, None to keep the one of the category.
+        @param max_spacing: maximum spacing between races, None to keep the one of the category. '''
+
+    custom = {"name": CATEGORIES[category]}
+    if races is not None:
+        custom["races"] = races
+    if max_spacing is not None:
+        custom["max_spacing"] = max_spacing
+
+    return category if len(custom) == 1 else custom
+
+
+def find_videos(paths):
+    ''' Lists the video files of the paths, expanding directories.
+        @param paths: paths of videos or directories. '''
+
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(VIDEO_EXTENSIONS):
+                    videos.append(os.path.join(path, name))
+        else:
+            videos.append(path)
+
+    return videos
+
+
+def load_runs(args):
+    ''' Builds the list of runs to process from the manifest and the videos in the arguments.
+        Settings missing in the manifest use the values of the arguments.
+        @param args: command line arguments. '''
+
+    defaults = {"crop": args.crop, "version": args.version, "category": args.category, "races": args.races, "max_spacing": args.max_spacing}
+    runs = []
+    if args.manifest is not None:
+        with open(args.manifest, "r") as file:
+            for entry in json.load(file):
+                run = dict(defaults)
+                run.update(entry)
+                runs.append(run)
+    for video in find_videos(args.videos):
+        run = dict(defaults)
+        run["video"] = video
+        runs.append(run)
+
+    return runs
+
+
+def process_run(run, workers=1, queue_depth=0, checkpoint=True, cache=True, profile=False, stride=1, ffmpeg=False, recognition_threads=0, realign=False):
+    ''' Processes a single run, returning its result as a dictionary.
+        @param run: dictionary with the video, crop, version and category of the run.
+        @param workers: number of processes scanning the video.
+        @param queue_depth: number of frames decoded ahead in a separate thread.
+        @param checkpoint: set to True to checkpoint the scan after every race,
+        resuming it if a previous process was interrupted.
+        @param cache: set to True to reuse the result of a previous processing of the video.
+        @param profile: set to True to add the counters and timings of the pipeline to the result.
+        @param stride: number of frames between the samples of the coarse to fine search.
+        @param ffmpeg: set to True to decode the video with ffmpeg, if it is installed.
+        @param recognition_threads: number of threads reading the races while the scan goes on.
+        @param realign: set to True to read again the races whose digits are far from the model. '''
+
+    result = {"video": run["video"]}
+    try:
+        version = option_index(run["version"], VERSIONS)
+        category = option_index(run["category"], CATEGORIES)
+        if category is None:
+            raise ValueError("The category can't be detected automatically")
+        category = run_category(category, run.get("races"), run.get("max_spacing"))
+
+        # Without a crop, the game is detected automatically
+        crop = run["crop"]
+        if crop is None:
+            crop, confidence = detect_crop(run["video"])
+            if crop is None:
+                raise IOError("Could not read " + run["video"])
+            result["crop_confidence"] = confidence
+            # The run is still processed, but flagged for a manual check
+            if confidence < CROP_CONFIDENCE:
+                result.setdefault("warnings", []).append("Low confidence in the detected crop")
+        h1, h2, w1, w2 = crop
+
+        start = perf_counter()
+        stats = {}
+        observer = ProfileObserver() if profile else None
+        checkpoint_file = checkpoint_path(run["video"]) if checkpoint else None
+        times, _, distances = process_video(run["video"], h1, h2, w1, w2, version, category, None, workers=workers, queue_depth=queue_depth, stats=stats, checkpoint=checkpoint_file, cache_dir=CACHE_DIR if cache else None, observer=observer, stride=stride, ffmpeg=ffmpeg, recognition_threads=recognition_threads, realign=realign)
+        elapsed = perf_counter() - start
+
+        # The region is detected on the first race
+        if version is None:
+            if "version" not in stats:
+                raise ValueError("No race found to detect the version")
+            version = stats["version"]
+            result["version_margin"] = stats["version_margin"]
+            # An ambiguous region is flagged for a manual check
+            if stats["version_margin"] < VERSION_MARGIN:
+                result.setdefault("warnings", []).append("Low margin in the detected version")
+
+        hours, minutes, seconds, miliseconds = calculate_total(times)
+        result.update({
+            "crop": [h1, h2, w1, w2],
+            "version": VERSIONS[version],
+            "category": category_settings(category)["name"],
+            "races": len(times),
+            "digits": times,
+            "distances": [[float(distance) for distance in race_distances[:, 0]] for race_distances in distances],
+            "total": "%d:%02d:%02d.%02d" % (hours, minutes, seconds, miliseconds),
+            "stats": {"seconds": elapsed, "cached": stats.get("cached", False)},
+        })
+        if observer is not None:
+            result["profile"] = observer.summary()
+        # The result is complete, the checkpoint isn't needed anymore
+        if checkpoint_file is not None:
+            remove_checkpoint(checkpoint_file)
+
+    except Exception as error:
+        result["error"] = str(error)
+
+    return result
+
+
+def result_name(video, taken):
+    ''' Name of the JSON result of a run, the name of its video. Videos with the same
+        name in different directories get a number, so their results don't overwrite
+        each other.
+        @param video: path of the video of the run.
+        @param taken: names already used by the batch, the new name is added to it. '''
+
+    base = os.path.splitext(os.path.basename(video))[0]
+    name = base
+    number = 1
+    while name in taken:
+        number += 1
+        name = "%s-%d" % (base, number)
+    taken.add(name)
+
+    return name + ".json"
+
+
+def write_result(result, output, name):
+    ''' Writes the result of a run as JSON in the output directory.
+        @param result: return of process_run().
+        @param output: output directory.
+        @param name: name of the file, see result_name(). '''
+
+    with open(os.path.join(output, name), "w") as file:
+        json.dump(result, file, indent=4)
+
+
+def main():
+    args = parse_arguments()
+    runs = load_runs(args)
+    if len(runs) == 0:
+        print("No runs to process. Pass the videos as arguments or use --manifest.", file=sys.stderr)
+        return 1
+
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+
+    # Processing the runs at the same time, each one in its own process
+    results = []
+    failed = 0
+    names = set()
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(runs)))) as executor:
+        futures = [executor.submit(process_run, run, args.workers, args.queue_depth, not args.no_checkpoint, not args.no_cache, args.profile, args.stride, args.ffmpeg, args.recognition_threads, not args.no_realign) for run in runs]
+        for future in futures:
+            result = future.result()
+            if "error" in result:
+                failed += 1
+                print("ERROR: " + result["video"] + ": " + result["error"], file=sys.stderr)
+            if args.output is not None:
+                write_result(result, args.output, result_name(result["video"], names))
+            results.append(result)
+
+    if args.output is None:
+        print(json.dumps(results, indent=4))
+
+    return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,533 @@
+import argparse
+import cv2
+import json
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import tracemalloc
+from time import perf_counter
+
+import videoProcessing
+from imageProcessing import *
+from instrumentation import ProfileObserver
+from syntheticVideo import SyntheticRun, load_dataset, write_run
+from videoProcessing import SKIP_READ, SKIP_GRAB, SKIP_SEEK, VideoReader, flash_corners, frame_buffers, probe_flash, scan_video, scan_video_parallel, seek_is_accurate, skip_frames, transform_frame
+
+# Times shorter than this, in seconds, are too noisy to catch regressions
+MIN_COMPARED_TIME = 0.05
+
+
+def time_function(function, inputs, repeat=3):
+    ''' Measures the best total time of calling a function on copies of every input.
+        @param function: function that receives a single image.
+        @param inputs: list of images.
+        @param repeat: number of times the measure is repeated. '''
+
+    best = None
+    for _ in range(repeat):
+        copies = [img.copy() for img in inputs]
+        start = perf_counter()
+        for img in copies:
+            function(img)
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def benchmark_areas(args):
+    ''' Compares the flood fill and the connected components noise removal
+        on real digit crops, ready to have their noisy areas removed.
+        @param args: command line arguments. '''
+
+    # Reproducing the state of the digits right before remove_noisy_areas
+    crops = []
+    for digit in load_dataset():
+        for size in (DIGIT_SIZE_HIGH, DIGIT_SIZE):
+            crop = cv2.resize(cv2.GaussianBlur(digit, (3, 3), 0), size)
+            crops.append(add_border(detect_edges(crop)))
+
+    def flood_fill(img):
+        areas = detect_colored_areas(img, WHITE, GRAY, BLACK)
+        for area in areas:
+            paint_colored_area(img, area[0], GRAY, WHITE)
+
+    def connected_components(img):
+        remove_small_areas(img, WHITE, BLACK)
+
+    # Making sure both backends agree before timing them
+    for crop in crops:
+        reference = crop.copy()
+        flood_fill(reference)
+        if not np.array_equal(reference, remove_small_areas(crop.copy(), WHITE, BLACK)):
+            raise AssertionError("Noise removal backends disagree")
+
+    reference_time = time_function(flood_fill, crops)
+    labeling_time = time_function(connected_components, crops)
+
+    return {
+        "crops": len(crops),
+        "flood_fill_s": reference_time,
+        "connected_components_s": labeling_time,
+        "speedup": reference_time / labeling_time,
+    }
+
+
+def benchmark_skip(args):
+    ''' Compares the time it takes to skip the timeout after each race
+        by reading, grabbing and seeking the frames of a video.
+        @param args: command line arguments. '''
+
+    result = {"seek_is_accurate": seek_is_accurate(args.video)}
+    for name, skip_mode in (("read", SKIP_READ), ("grab", SKIP_GRAB), ("seek", SKIP_SEEK)):
+        video = cv2.VideoCapture(args.video)
+        skips = 0
+        start = perf_counter()
+        # Skip timeouts until the end of the video, reading the frame after each one
+        while skip_frames(video, args.timeout - 1, skip_mode) and video.read()[0]:
+            skips += 1
+        result[name + "_s"] = perf_counter() - start
+        video.release()
+        result["timeouts"] = skips
+
+    result["grab_speedup"] = result["read_s"] / result["grab_s"]
+    result["seek_speedup"] = result["read_s"] / result["seek_s"]
+
+    return result
+
+
+def benchmark_workers(args):
+    ''' Measures how the parallel scan of a video scales from one process
+        to the maximum number of workers.
+        @param args: command line arguments. '''
+
+    h1, h2, w1, w2 = video_crop(args)
+    skip_mode = SKIP_SEEK if seek_is_accurate(args.video) else SKIP_GRAB
+    result = {}
+    races = None
+    for workers in range(1, args.workers + 1):
+        start = perf_counter()
+        found = [flash_index for flash_index, _, _ in scan_video_parallel(args.video, h1, h2, w1, w2, args.version, skip_mode, workers)]
+        result[str(workers) + "_workers_s"] = perf_counter() - start
+        # Every number of workers must find the same races
+        if races is None:
+            races = found
+        elif found != races:
+            raise AssertionError("Parallel scan with " + str(workers) + " workers found different races")
+
+    result["races"] = len(races)
+    result["speedup"] = result["1_workers_s"] / result[str(args.workers) + "_workers_s"]
+
+    return result
+
+
+def benchmark_pipeline(args):
+    ''' Compares scanning a video with the decoding in the same thread against
+        decoding in a separate thread, for a few depths of the decoding queue.
+        Reports how many times the analysis starved and the decoder was blocked.
+        @param args: command line arguments. '''
+
+    h1, h2, w1, w2 = video_crop(args)
+    skip_mode = SKIP_SEEK if seek_is_accurate(args.video) else SKIP_GRAB
+    result = {}
+    for queue_depth in [0] + args.queue_depths:
+        stats = {}
+        start = perf_counter()
+        for _ in scan_video(args.video, h1, h2, w1, w2, args.version, skip_mode, queue_depth=queue_depth, stats=stats):
+            pass
+        name = "queue_" + str(queue_depth)
+        result[name + "_s"] = perf_counter() - start
+        for counter, value in stats.items():
+            result[name + "_" + counter] = value
+
+    return result
+
+
+def benchmark_sparse(args):
+    ''' Compares the full scan of a video with the coarse to fine search for a few
+        strides, reporting how many frames each one decoded and checked. Every stride must find
+        the same races as the full scan.
+        @param args: command line arguments. '''
+
+    h1, h2, w1, w2 = video_crop(args)
+    accurate = seek_is_accurate(args.video)
+    skip_mode = SKIP_SEEK if accurate else SKIP_GRAB
+    result = {"seek_is_accurate": accurate}
+    races = None
+    for stride in [1] + args.strides:
+        observer = ProfileObserver()
+        start = perf_counter()
+        found = [(flash_index, index) for flash_index, index, _ in scan_video(args.video, h1, h2, w1, w2, args.version, skip_mode, observer=observer, stride=stride)]
+        name = "stride_" + str(stride)
+        result[name + "_s"] = perf_counter() - start
+        result[name + "_frames_decoded"] = observer.totals["frames_decoded"]
+        result[name + "_frames_grabbed"] = observer.totals["frames_grabbed"]
+        result[name + "_rescans"] = observer.totals["rescans"]
+        if races is None:
+            races = found
+        elif found != races:
+            raise AssertionError("Coarse to fine search with a stride of " + str(stride) + " found different races")
+        result[name + "_decoded_fraction"] = observer.totals["frames_decoded"] / result["stride_1_frames_decoded"]
+        # Frames converted and checked, which the samples spare, unlike the decoding
+        result[name + "_checked_fraction"] = (observer.totals["frames_decoded"] - observer.totals["frames_grabbed"]) / result["stride_1_frames_decoded"]
+
+    result["races"] = len(races)
+
+    return result
+
+
+def run_transforms(file_path, h1, h2, w1, w2, buffered, frame_count):
+    ''' Reads and transforms the first frames of a video, either into new pictures for
+        every frame or into reused buffers. Runs in a fresh process, so the peak memory
+        is the one of the transforms alone. The frames are read twice, once to time
+        them and once to trace their allocations, which slows them down.
+        @param file_path: path of the video file.
+        @param h1, h2, w1, w2: crop of the game in the video.
+        @param buffered: set to True to reuse the buffers of the frames.
+        @param frame_count: number of frames read. '''
+
+    corners = flash_corners(h1, h2, w1, w2)
+    buffers = frame_buffers() if buffered else None
+    result = {}
+    for traced in (False, True):
+        video = VideoReader(file_path) if buffered else cv2.VideoCapture(file_path)
+        allocated = []
+        start = perf_counter()
+        for _ in range(frame_count):
+            # The tracing restarts for every frame, so its peak is the memory allocated
+            # by the frame alone. tracemalloc.reset_peak() needs Python 3.9
+            if traced:
+                tracemalloc.start()
+            status, frame = video.read()
+            if status == False:
+                if traced:
+                    tracemalloc.stop()
+                break
+            probe_flash(frame, corners)
+            transform_frame(frame, h1, h2, w1, w2, buffers)
+            if traced:
+                allocated.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        elapsed = perf_counter() - start
+        video.release()
+
+        if traced:
+            result["allocated_kb_per_frame"] = float(np.mean(allocated)) / 1024
+        else:
+            result["seconds"] = elapsed
+
+    result["peak_rss_mb"] = peak_rss()
+
+    return result
+
+
+def benchmark_transform(args):
+    ''' Compares reading and transforming frames into new pictures against reusing
+        the same buffers for every frame, reporting the time, the memory traced by
+        tracemalloc for each frame and the peak memory of each one.
+        @param args: command line arguments. '''
+
+    h1, h2, w1, w2 = video_crop(args)
+    context = multiprocessing.get_context("spawn")
+    result = {}
+    for name, buffered in (("allocated", False), ("buffered", True)):
+        with context.Pool(1) as pool:
+            measures = pool.apply(run_transforms, (args.video, h1, h2, w1, w2, buffered, args.frames))
+        result[name + "_s"] = measures["seconds"]
+        result[name + "_kb_per_frame"] = measures["allocated_kb_per_frame"]
+        result[name + "_peak_rss_mb"] = measures["peak_rss_mb"]
+
+    result["speedup"] = result["allocated_s"] / result["buffered_s"]
+
+    return result
+
+
+class StageTimer:
+    ''' Accumulates the time spent and the number of calls of each stage of the pipeline.
+        Calls from threads other than the one that created the timer, like the threads
+        reading the races, overlap with the stages of the scan, so their time is kept apart. '''
+
+    def __init__(self):
+        self.seconds = {}
+        self.overlapped = {}
+        self.calls = {}
+        self.thread = threading.get_ident()
+        self.lock = threading.Lock()
+
+    def add(self, stage, elapsed):
+        ''' Adds a call to a stage.
+            @param stage: name of the stage.
+            @param elapsed: seconds spent in the call. '''
+
+        seconds = self.seconds if threading.get_ident() == self.thread else self.overlapped
+        with self.lock:
+            seconds[stage] = seconds.get(stage, 0.0) + elapsed
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def wrap(self, stage, function):
+        ''' Wraps a function so the time of its calls is added to a stage.
+            @param stage: name of the stage.
+            @param function: function to time. '''
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, perf_counter() - start)
+
+        return timed
+
+
+class TimedReader:
+    ''' Frame source that adds the time of reading and skipping frames to a StageTimer. '''
+
+    def __init__(self, video, timer):
+        ''' @param video: frame source.
+            @param timer: StageTimer. '''
+
+        self.video = video
+        self.read = timer.wrap("decode", video.read)
+        self.skip = timer.wrap("skip", video.skip)
+        if hasattr(video, "seek"):
+            self.seek = timer.wrap("seek", video.seek)
+        self.release = video.release
+
+
+def peak_rss():
+    ''' Peak resident memory of the process in MB, None if it can't be measured. '''
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_end_to_end(file_path, h1, h2, w1, w2, version, category, ffmpeg=False, recognition_threads=0):
+    ''' Processes a video with every stage of the pipeline timed. Runs in a fresh
+        process, so the peak memory is the one of processing the video alone.
+        @param file_path: path of the video file.
+        @param h1, h2, w1, w2: crop of the game in the video.
+        @param version: index of the game region.
+        @param category: index of the run category.
+        @param ffmpeg: set to True to decode the video with ffmpeg, if it is installed.
+        @param recognition_threads: number of threads reading the races while the scan goes on. '''
+
+    timer = StageTimer()
+    # Timestamp of each race, taken once its digits are predicted
+    race_ends = []
+
+    def open_video(*args):
+        return TimedReader(videoProcessing.open_frame_source(*args), timer)
+
+    def open_ffmpeg(*args):
+        video = videoProcessing.open_ffmpeg_source(*args)
+        return None if video is None else TimedReader(video, timer)
+
+    def predict_digits(*args):
+        result = predict(*args)
+        race_ends.append(perf_counter())
+        return result
+
+    # The stages are timed by replacing the functions called by the pipeline
+    videoProcessing.open_frame_source = videoProcessing.open_video
+    videoProcessing.open_video = open_video
+    videoProcessing.open_ffmpeg_source = videoProcessing.open_ffmpeg
+    videoProcessing.open_ffmpeg = open_ffmpeg
+    for stage, names in (
+        ("setup", ("seek_is_accurate", "load_model")),
+        ("flash_probe", ("probe_flash", "is_flash")),
+        ("crop_resize", ("transform_frame",)),
+        ("hsv_probe", ("matches_colors",)),
+        ("read_race", ("read_race", "measure_alignment")),
+        ("process_digit", ("process_digit",)),
+        ("knn", ("predict_digits",)),
+    ):
+        for name in names:
+            setattr(videoProcessing, name, timer.wrap(stage, getattr(videoProcessing, name)))
+    predict = videoProcessing.predict_digits
+    videoProcessing.predict_digits = predict_digits
+
+    start = perf_counter()
+    times, _, _ = videoProcessing.process_video(file_path, h1, h2, w1, w2, version, category, None, ffmpeg=ffmpeg, recognition_threads=recognition_threads)
+    elapsed = perf_counter() - start
+
+    result = {
+        "races": len(times),
+        "total_s": elapsed,
+        "ffmpeg": ffmpeg and shutil.which("ffmpeg") is not None,
+        "frames_decoded": timer.calls.get("decode", 0),
+        "decoded_fps": timer.calls.get("decode", 0) / elapsed,
+        # Frames of the video per second, counting the ones skipped
+        "video_fps": videoProcessing.count_frames(file_path) / elapsed,
+    }
+    # Alignment is the time of reading a race that isn't spent processing digits
+    timer.seconds["alignment"] = timer.seconds.pop("read_race", 0.0) - timer.seconds.get("process_digit", 0.0)
+    if "read_race" in timer.overlapped:
+        timer.overlapped["alignment"] = timer.overlapped.pop("read_race") - timer.overlapped.get("process_digit", 0.0)
+    for stage, seconds in timer.seconds.items():
+        result[stage + "_s"] = seconds
+    # The races read by other threads overlap with the scan, so they aren't part of the wall time
+    for stage, seconds in timer.overlapped.items():
+        result[stage + "_overlapped_s"] = seconds
+    result["other_s"] = elapsed - sum(timer.seconds.values())
+
+    # Wall time between the results of consecutive races
+    if len(race_ends) > 0:
+        latencies = np.diff([start] + race_ends)
+        result["race_latency_mean_s"] = float(latencies.mean())
+        result["race_latency_max_s"] = float(latencies.max())
+    result["peak_rss_mb"] = peak_rss()
+    result["digits"] = times
+
+    return result
+
+
+def benchmark_e2e(args):
+    ''' Processes the video from start to end, reporting the frames decoded per second,
+        the time spent in each stage of the pipeline, the latency of each race and the
+        peak memory. With a synthetic run, the digits are checked against its lap times.
+        @param args: command line arguments. '''
+
+    h1, h2, w1, w2 = video_crop(args)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        result = pool.apply(run_end_to_end, (args.video, h1, h2, w1, w2, args.version, args.category, args.ffmpeg, args.recognition_threads))
+
+    digits = result.pop("digits")
+    if args.truth is not None:
+        result["digits_correct"] = sum(a == b for race, expected in zip(digits, args.truth) for a, b in zip(race, expected))
+        result["digits_expected"] = 15 * len(args.truth)
+
+    return result
+
+
+def compare_results(results, baseline, threshold):
+    ''' Compares the results with the results of a previous run, returning the
+        measures that got worse by more than the threshold. Measures ending in
+        "_s" are times, lower is better, and measures ending in "_fps" are rates,
+        higher is better. Times too short to be measured reliably are ignored.
+        @param results: dictionary with the result of each benchmark.
+        @param baseline: results of the previous run.
+        @param threshold: fraction of the previous measure allowed as a slowdown. '''
+
+    regressions = []
+    for name, result in results.items():
+        for key, value in result.items():
+            previous = baseline.get(name, {}).get(key)
+            if not isinstance(value, float) or not isinstance(previous, float) or previous <= 0:
+                continue
+            if key.endswith("_s") and previous >= MIN_COMPARED_TIME and value > previous * (1 + threshold):
+                regressions.append((name, key, previous, value))
+            elif key.endswith("_fps") and value < previous * (1 - threshold):
+                regressions.append((name, key, previous, value))
+
+    return regressions
+
+
+def video_crop(args):
+    ''' Crop of the game in the benchmark video, the whole frame if none was given.
+        @param args: command line arguments. '''
+
+    if args.crop is not None:
+        return args.crop
+
+    video = cv2.VideoCapture(args.video)
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    video.release()
+
+    return 0, height, 0, width
+
+
+def synthetic_video(args, directory):
+    ''' Writes the synthetic run used by the video benchmarks when no video is given,
+        so they are reproducible without real speedrun footage. Returns the path
+        of the video and the lap times of the run.
+        @param args: command line arguments.
+        @param directory: directory where the video is written. '''
+
+    run = SyntheticRun(args.races, tuple(args.size), args.version, seed=args.seed)
+    file_path = os.path.join(directory, "synthetic.mp4")
+    write_run(run, file_path)
+
+    return file_path, run.times
+
+
+BENCHMARKS = {
+    "areas": benchmark_areas,
+    "skip": benchmark_skip,
+    "workers": benchmark_workers,
+    "pipeline": benchmark_pipeline,
+    "sparse": benchmark_sparse,
+    "transform": benchmark_transform,
+    "e2e": benchmark_e2e,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CTR-AutoIGT benchmarks")
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run (" + ", ".join(BENCHMARKS) + "), every one if none is given")
+    parser.add_argument("--video", help="speedrun video used by the video benchmarks, a synthetic run is generated if not given")
+    parser.add_argument("--races", type=int, default=5, help="number of races of the synthetic run")
+    parser.add_argument("--size", type=int, nargs=2, default=(640, 480), metavar=("WIDTH", "HEIGHT"), help="size of the frames of the synthetic run")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic run")
+    parser.add_argument("--timeout", type=int, default=2100, help="number of frames skipped after each race")
+    parser.add_argument("--crop", type=int, nargs=4, metavar=("H1", "H2", "W1", "W2"), help="crop of the game in the video")
+    parser.add_argument("--version", type=int, default=0, help="game region: 0 NTSC-U, 1 PAL, 2 NTSC-J")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="maximum number of processes scanning the video")
+    parser.add_argument("--queue-depths", type=int, nargs="+", default=[2, 8, 32], help="depths of the decoding queue compared by the pipeline benchmark")
+    parser.add_argument("--strides", type=int, nargs="+", default=[4, 8, 16, 32], help="strides of the coarse to fine search compared by the sparse benchmark")
+    parser.add_argument("--frames", type=int, default=1000, help="number of frames read by the transform benchmark")
+    parser.add_argument("--category", type=int, default=0, help="index of the run category of the end to end benchmark: 0 Any%% Warpless, 1 All Cups, 2 Single Cup, 3 Custom")
+    parser.add_argument("--ffmpeg", action="store_true", help="decode the video of the end to end benchmark with ffmpeg, if it is installed")
+    parser.add_argument("--recognition-threads", type=int, default=0, help="number of threads reading the races in the end to end benchmark while the scan goes on")
+    parser.add_argument("--json", help="file where the results are written as JSON")
+    parser.add_argument("--baseline", help="JSON results of a previous run, the exit code is 1 if any time got worse than the threshold")
+    parser.add_argument("--threshold", type=float, default=0.1, help="fraction of the baseline times allowed as a slowdown")
+    args = parser.parse_args()
+    args.truth = None
+
+    # Run every benchmark, or only the ones passed as arguments
+    names = args.benchmarks
+    if len(names) == 0:
+        names = list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: " + name)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        if args.video is None and any(name != "areas" for name in names):
+            args.video, args.truth = synthetic_video(args, directory)
+        for name in names:
+            result = BENCHMARKS[name](args)
+            results[name] = result
+            print(name + ": " + ", ".join(key + "=" + (("%.4f" % value) if isinstance(value, float) else str(value)) for key, value in result.items()))
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+    # Catching slowdowns against a previous run
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            regressions = compare_results(results, json.load(file), args.threshold)
+        for name, key, previous, value in regressions:
+            print("REGRESSION: %s %s %.4f -> %.4f" % (name, key, previous, value), file=sys.stderr)
+        return 1 if len(regressions) > 0 else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+# Number of frames sampled across the video
+CROP_SAMPLES = 24
+# Width the sampled frames are shrunk to before looking for the game
+CROP_WIDTH = 320
+# Minimum standard deviation of a pixel across the samples to consider it part of the game
+ACTIVITY_THRESHOLD = 12
+# Fraction of the most active line that a line needs to be part of the game
+PROJECTION_THRESHOLD = 0.5
+# Aspect ratio of the game
+GAME_ASPECT = 4 / 3
+# Minimum confidence to use the detected crop without asking the user
+CROP_CONFIDENCE = 0.6
+
+
+def sample_frames(file_path, samples=CROP_SAMPLES, width=CROP_WIDTH):
+    ''' Reads grayscale frames spread across the video, shrunk to a small width.
+        Returns the frames and the size (height, width) of the video.
+        @param file_path: path of the video file.
+        @param samples: number of frames to read.
+        @param width: width of the frames returned, smaller videos are kept as they are. '''
+
+    video = cv2.VideoCapture(file_path)
+    frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    size = None
+    for i in range(samples):
+        # Seeking doesn't need to be accurate, any frame around the position will do.
+        # Without the number of frames, the first seconds of the video are sampled.
+        if frame_count > 0:
+            video.set(cv2.CAP_PROP_POS_FRAMES, frame_count * (2 * i + 1) // (2 * samples))
+        else:
+            for _ in range(30):
+                video.grab()
+        status, frame = video.read()
+        if status:
+            size = frame.shape[:2]
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            # Averaging the pixels keeps the edges of the game where they were
+            if size[1] > width:
+                gray = cv2.resize(gray, (width, max(1, round(size[0] * width / size[1]))), interpolation=cv2.INTER_AREA)
+            frames.append(gray)
+    video.release()
+
+    return np.array(frames), size
+
+
+def active_span(projection):
+    ''' Finds the longest run of lines active enough to be part of the game.
+        Returns the first and the last + 1 lines of the run, or every line if no
+        line is active.
+        @param projection: fraction of active pixels of each line. '''
+
+    # Lines projected from no pixel at all have no activity
+    projection = np.nan_to_num(projection)
+    active = projection >= PROJECTION_THRESHOLD * projection.max(initial=0)
+    # Borders of every run of active lines
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    if len(starts) == 0:
+        return 0, len(projection)
+    longest = np.argmax(ends - starts)
+
+    return int(starts[longest]), int(ends[longest])
+
+
+def detect_crop(file_path, samples=CROP_SAMPLES):
+    ''' Detects the area of the video where the game is, looking for the
+        rectangle of pixels that change across the video, since letterboxes,
+        borders and overlays barely change. Returns the crop (h1, h2, w1, w2)
+        and a confidence score between 0 and 1.
+        @param file_path: path of the video file.
+        @param samples: number of frames sampled across the video. '''
+
+    frames, size = sample_frames(file_path, samples)
+    if len(frames) < 2:
+        return None, 0.0
+    _, height, width = frames.shape
+
+    # Pixels that change across the video
+    active = np.std(frames, axis=0) > ACTIVITY_THRESHOLD
+
+    # Projecting the columns finds the sides of the game, then the rows
+    # are projected only inside those sides, so overlays beside the game are ignored
+    w1, w2 = active_span(active.mean(axis=0))
+    h1, h2 = active_span(active[:, w1:w2].mean(axis=1))
+    # Projecting the columns again, now only inside the rows of the game
+    w1, w2 = active_span(active[h1:h2].mean(axis=0))
+
+    # The game is confidently found if it is active while its surroundings aren't,
+    # and if it has the aspect ratio of the game
+    inside = active[h1:h2, w1:w2]
+    outside_pixels = active.size - inside.size
+    outside = (active.sum() - inside.sum()) / outside_pixels if outside_pixels > 0 else 0.0
+    aspect = (w2 - w1) / (h2 - h1)
+    aspect_score = min(aspect, GAME_ASPECT) / max(aspect, GAME_ASPECT)
+    confidence = float(inside.mean() * (1 - outside) * aspect_score)
+
+    # Scaling the crop back to the size of the video
+    h1, h2 = (round(h * size[0] / height) for h in (h1, h2))
+    w1, w2 = (round(w * size[1] / width) for w in (w1, w2))
+
+    return (h1, h2, w1, w2), confidence
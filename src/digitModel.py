@@ -0,0 +1,162 @@
+import numpy as np
+import pickle
+
+# Model files
+MODEL_PATH = "CTR_digits.knn"
+COMPACT_MODEL_PATH = "CTR_digits.bin"
+
+# Compact model format. The header is followed by one label per digit
+# and then the bit-packed pixels of every digit, one row per digit.
+# Labels and rows are padded to 8 bytes, so rows can be read as 64-bit words.
+MODEL_MAGIC = b"CTRK"
+MODEL_VERSION = 1
+MODEL_HEADER = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u2"),
+    ("neighbors", "<u2"),
+    ("count", "<u4"),
+    ("height", "<u2"),
+    ("width", "<u2"),
+])
+
+# Number of bits set in each possible byte, for numpy versions without bitwise_count
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+# Pixel value of the white pixels of a processed digit
+PIXEL_SCALE = 255
+
+
+class DigitModel:
+    ''' K-nearest neighbors classifier over bit-packed binary digits,
+        reading its dataset directly from a memory-mapped compact model file. '''
+
+    def __init__(self, labels, features, neighbors, height, width):
+        ''' @param labels: label of each digit of the dataset.
+            @param features: bit-packed pixels of each digit of the dataset.
+            @param neighbors: number of neighbors used in the prediction.
+            @param height, width: size of the digits. '''
+
+        self.labels = labels
+        self.features = features
+        self.n_neighbors = neighbors
+        self.height = height
+        self.width = width
+
+    def kneighbors(self, X):
+        ''' Finds the nearest neighbors of each digit using the hamming distance
+            of the packed pixels. Returns the distances, scaled to match the euclidean
+            distance of the original 0/255 pixels, and the indices of the neighbors.
+            @param X: matrix with one flattened processed digit per row. '''
+
+        queries = pack_digits(X, self.features.shape[1])
+        distances = np.empty((len(queries), self.n_neighbors))
+        indices = np.empty((len(queries), self.n_neighbors), np.intp)
+
+        for i in range(len(queries)):
+            # Counting the different pixels between the digit and the whole dataset
+            hamming = popcount(np.bitwise_xor(self.features, queries[i]))
+            nearest = np.argsort(hamming, kind="stable")[:self.n_neighbors]
+            distances[i] = PIXEL_SCALE * np.sqrt(hamming[nearest])
+            indices[i] = nearest
+
+        return distances, indices
+
+    def predict(self, X):
+        ''' Predicts the number of each digit.
+            @param X: matrix with one flattened processed digit per row. '''
+
+        _, indices = self.kneighbors(X)
+        return vote(self.labels[indices])
+
+
+def popcount(words):
+    ''' Counts the bits set in each row of a matrix of 64-bit words.
+        @param words: matrix of uint64. '''
+
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.uint32)
+    return POPCOUNT[words.view(np.uint8)].sum(axis=1, dtype=np.uint32)
+
+
+def row_words(pixels):
+    ''' Number of 64-bit words needed to store the bits of a digit.
+        @param pixels: number of pixels of the digit. '''
+
+    return (pixels + 63) // 64
+
+
+def pack_digits(X, words):
+    ''' Packs binary digits into rows of 64-bit words, one bit per pixel.
+        @param X: matrix with one flattened processed digit per row.
+        @param words: number of words of each row. '''
+
+    packed = np.packbits(np.asarray(X) != 0, axis=1)
+    rows = np.zeros((len(packed), words * 8), np.uint8)
+    rows[:, :packed.shape[1]] = packed
+
+    return rows.view(np.uint64)
+
+
+def vote(neighbor_labels):
+    ''' Majority vote of the labels of the neighbors of each digit.
+        Ties go to the smallest number, like KNeighborsClassifier.predict.
+        @param neighbor_labels: matrix with the labels of the neighbors of each digit. '''
+
+    counts = (neighbor_labels[:, :, np.newaxis] == np.arange(10)).sum(axis=1)
+    return counts.argmax(axis=1)
+
+
+def labels_size(count):
+    ''' Size in bytes of the labels, padded to 8 bytes.
+        @param count: number of digits in the model. '''
+
+    return (count + 7) // 8 * 8
+
+
+def save_model(file_path, X, Y, neighbors=5, height=66, width=39):
+    ''' Writes a compact model file.
+        @param file_path: path of the model file.
+        @param X: matrix with one flattened processed digit per row.
+        @param Y: label of each digit.
+        @param neighbors: number of neighbors used in the prediction.
+        @param height, width: size of the digits. '''
+
+    header = np.array([(MODEL_MAGIC, MODEL_VERSION, neighbors, len(Y), height, width)], MODEL_HEADER)
+    labels = np.zeros(labels_size(len(Y)), np.uint8)
+    labels[:len(Y)] = Y
+    with open(file_path, "wb") as file:
+        file.write(header.tobytes())
+        file.write(labels.tobytes())
+        file.write(pack_digits(X, row_words(height * width)).astype("<u8").tobytes())
+
+
+def load_compact_model(file_path=COMPACT_MODEL_PATH):
+    ''' Memory-maps a compact model file.
+        @param file_path: path of the model file. '''
+
+    data = np.memmap(file_path, np.uint8, mode="r")
+    header = np.frombuffer(data[:MODEL_HEADER.itemsize].tobytes(), MODEL_HEADER)[0]
+    if header["magic"] != MODEL_MAGIC:
+        raise ValueError(file_path + " is not a CTR digits model")
+    if header["version"] != MODEL_VERSION:
+        raise ValueError(file_path + " has an unsupported model version: " + str(header["version"]))
+
+    count = int(header["count"])
+    height = int(header["height"])
+    width = int(header["width"])
+    words = row_words(height * width)
+    labels_start = MODEL_HEADER.itemsize
+    features_start = labels_start + labels_size(count)
+
+    labels = data[labels_start : labels_start + count]
+    features = data[features_start : features_start + count * words * 8].view("<u8").reshape(count, words)
+
+    return DigitModel(labels, features, int(header["neighbors"]), height, width)
+
+
+def load_model():
+    ''' Loads the compact model, falling back to the pickled KNeighborsClassifier. '''
+
+    try:
+        return load_compact_model()
+    except FileNotFoundError:
+        return pickle.load(open(MODEL_PATH, 'rb'))
@@ -0,0 +1,652 @@
+import cv2
+import numpy as np
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+# Every frame source has the same interface: read() returns the status and the
+# next frame, skip(count) jumps over frames returning False if the source ended,
+# and release() closes the source. Frames are BGR pictures. Sources that can go
+# back also have seek(index), which moves to a frame so it is the next one read.
+
+# Extensions of the pictures of an image sequence
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# Ways of skipping the frames of a timeout
+SKIP_READ = 0
+SKIP_GRAB = 1
+SKIP_SEEK = 2
+# Seeking decodes from the previous keyframe, so shorter skips grab the frames
+SEEK_MIN_FRAMES = 60
+
+
+def seek_is_accurate(file_path, probe=300):
+    ''' Checks if seeking lands on the right frame in this video container,
+        comparing a frame reached by seeking with the same frame read sequentially.
+        @param file_path: path of the video file.
+        @param probe: index of the frame used in the comparison. '''
+
+    # Image sequences always land on the right picture
+    if os.path.isdir(file_path):
+        return True
+
+    video = cv2.VideoCapture(file_path)
+    for _ in range(probe):
+        video.grab()
+    status, expected = video.read()
+
+    seeked = video.set(cv2.CAP_PROP_POS_FRAMES, probe) and video.get(cv2.CAP_PROP_POS_FRAMES) == probe
+    if seeked:
+        seeked, frame = video.read()
+    video.release()
+
+    return status and seeked and np.array_equal(frame, expected)
+
+
+def skip_frames(video, count, skip_mode=SKIP_GRAB):
+    ''' Skips frames of the video without converting them to pictures.
+        Returns False if the video ended before skipping every frame.
+        @param video: cv2 video.
+        @param count: number of frames to skip.
+        @param skip_mode: SKIP_READ decodes every frame like a regular read,
+        SKIP_GRAB only grabs the frames, SKIP_SEEK jumps straight to the last frame. '''
+
+    if skip_mode == SKIP_SEEK and count >= SEEK_MIN_FRAMES:
+        target = video.get(cv2.CAP_PROP_POS_FRAMES) + count
+        # Seeking past the end of the video fails, so finishing the skip
+        # with grabs tells if the video really ended
+        if target < video.get(cv2.CAP_PROP_FRAME_COUNT) and video.set(cv2.CAP_PROP_POS_FRAMES, target):
+            return True
+
+    for _ in range(count):
+        if skip_mode == SKIP_READ:
+            status, _ = video.read()
+        else:
+            status = video.grab()
+        if status == False:
+            return False
+
+    return True
+
+
+class VideoReader:
+    ''' Reads the frames of a video in the same thread that analyzes them.
+        Every frame is decoded into the buffer of the previous one. '''
+
+    def __init__(self, file_path, skip_mode=SKIP_GRAB):
+        ''' @param file_path: path of the video file, or index of a capture device.
+            @param skip_mode: how frames are skipped. '''
+
+        self.video = cv2.VideoCapture(file_path)
+        self.skip_mode = skip_mode
+        self.frame = None
+
+    def read(self):
+        ''' Reads the next frame of the video. '''
+
+        status, frame = self.video.read(self.frame)
+        if status:
+            self.frame = frame
+
+        return status, frame
+
+    def skip(self, count):
+        ''' Skips frames of the video, returning False if the video ended.
+            @param count: number of frames to skip. '''
+
+        return skip_frames(self.video, count, self.skip_mode)
+
+    def seek(self, index):
+        ''' Moves to a frame of the video, which is only accurate if
+            seek_is_accurate() is True. Returns False if seeking failed.
+            @param index: index of the next frame read. '''
+
+        return self.video.set(cv2.CAP_PROP_POS_FRAMES, index)
+
+    def release(self):
+        ''' Closes the video. '''
+
+        self.video.release()
+
+
+class ThreadedVideoReader:
+    ''' Decodes the frames of a video in a separate thread, which fills a bounded queue
+        with frames decoded into a ring of preallocated buffers. OpenCV releases the GIL
+        while decoding, so decoding overlaps with the analysis of the previous frames.
+        Counts how many times the analysis waited for a frame (starved) and how many
+        times the decoder waited for the analysis (blocked). '''
+
+    def __init__(self, file_path, skip_mode=SKIP_GRAB, queue_depth=8):
+        ''' @param file_path: path of the video file.
+            @param skip_mode: how frames are skipped.
+            @param queue_depth: maximum number of decoded frames waiting to be analyzed. '''
+
+        self.video = cv2.VideoCapture(file_path)
+        self.skip_mode = skip_mode
+        self.queue_depth = queue_depth
+        # Decoded frames waiting to be analyzed, and buffers free to decode into
+        self.frames = queue.Queue(queue_depth)
+        self.buffers = queue.Queue()
+        # Index of the next frame the analysis wants, moved forward when skipping
+        self.position = 0
+        self.target = 0
+        # Buffer of the frame being analyzed, returned to the ring on the next read
+        self.current = None
+        self.ended = False
+        # Error that stopped the decoding thread, raised by read()
+        self.error = None
+        self.starved = 0
+        self.blocked = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    def decode(self):
+        ''' Decoding loop of the separate thread. Errors of the decoder are kept
+            and raised by read(), instead of leaving the analysis waiting for frames. '''
+
+        index = 0
+        try:
+            index = self.decode_frames()
+        except Exception as error:
+            self.error = error
+        finally:
+            # Let the analysis know the video ended
+            self.wait(self.frames.put, (index, False, None))
+
+    def decode_frames(self):
+        ''' Decodes frames until the video ends or the reader is released.
+            Returns the index of the frame after the last one decoded. '''
+
+        index = 0
+        status = True
+        allocated = False
+        while status and not self.stopped.is_set():
+
+            # Jump over the frames the analysis doesn't need anymore
+            target = self.target
+            if target > index:
+                status = skip_frames(self.video, target - index, self.skip_mode)
+                index = target
+                if status == False:
+                    break
+
+            # Decode into a free buffer of the ring. The first frame allocates the ring.
+            buffer = None
+            if allocated:
+                buffer = self.wait(self.buffers.get)
+                if buffer is None:
+                    break
+            status, frame = self.video.read(buffer)
+            if status and not allocated:
+                allocated = True
+                for _ in range(self.queue_depth + 1):
+                    self.buffers.put(np.empty_like(frame))
+
+            if self.frames.full():
+                self.blocked += 1
+            self.wait(self.frames.put, (index, status, frame))
+            index += 1
+
+        return index
+
+    def wait(self, function, *args):
+        ''' Calls a blocking queue function, giving up if the reader is released.
+            @param function: get or put of a queue.
+            @param args: item to put in the queue. '''
+
+        while not self.stopped.is_set():
+            try:
+                return function(*args, timeout=0.1)
+            except (queue.Empty, queue.Full):
+                continue
+
+    def read(self):
+        ''' Reads the next frame of the video. '''
+
+        # The previous frame is done, so its buffer can be reused
+        if self.current is not None:
+            self.buffers.put(self.current)
+            self.current = None
+
+        while not self.ended:
+            if self.frames.empty():
+                self.starved += 1
+            index, status, frame = self.frames.get()
+            if status == False:
+                self.ended = True
+                if self.error is not None:
+                    raise self.error
+            # Frames decoded before a skip are discarded
+            elif index < self.position:
+                self.buffers.put(frame)
+            else:
+                self.position = index + 1
+                self.current = frame
+                return True, frame
+
+        return False, None
+
+    def skip(self, count):
+        ''' Skips frames of the video. The end of the video is only
+            known once the next frame is read.
+            @param count: number of frames to skip. '''
+
+        self.position += count
+        self.target = self.position
+
+        return not self.ended
+
+    def release(self):
+        ''' Stops the decoding thread and closes the video. '''
+
+        self.stopped.set()
+        self.thread.join()
+        self.video.release()
+
+
+def list_images(directory):
+    ''' Lists the pictures of an image sequence, in the order of their names.
+        @param directory: directory of the pictures. '''
+
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+    return [os.path.join(directory, name) for name in names]
+
+
+def count_frames(file_path):
+    ''' Number of frames of a video or image sequence, 0 if it isn't known.
+        @param file_path: path of the video file or of the directory of pictures. '''
+
+    if os.path.isdir(file_path):
+        return len(list_images(file_path))
+
+    video = cv2.VideoCapture(file_path)
+    frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    video.release()
+
+    return max(0, frame_count)
+
+
+class ImageSequenceReader:
+    ''' Reads the pictures of a directory as the frames of a video. Skipped
+        pictures are never decoded. '''
+
+    def __init__(self, directory):
+        ''' @param directory: directory of the pictures. '''
+
+        self.images = list_images(directory)
+        # Index of the next picture
+        self.index = 0
+
+    def read(self):
+        ''' Reads the next picture. '''
+
+        if self.index >= len(self.images):
+            return False, None
+        frame = cv2.imread(self.images[self.index], cv2.IMREAD_COLOR)
+        self.index += 1
+
+        return frame is not None, frame
+
+    def skip(self, count):
+        ''' Skips pictures, returning False if the sequence ended.
+            @param count: number of pictures to skip. '''
+
+        self.index += count
+        return self.index <= len(self.images)
+
+    def seek(self, index):
+        ''' Moves to a picture of the sequence.
+            @param index: index of the next picture read. '''
+
+        self.index = index
+        return self.index <= len(self.images)
+
+    def release(self):
+        ''' Nothing to close, pictures are read one at a time. '''
+
+        pass
+
+
+class GeneratedReader:
+    ''' Reads frames from any iterable, like a generator of synthetic frames. '''
+
+    def __init__(self, frames):
+        ''' @param frames: iterable of BGR frames. '''
+
+        self.frames = iter(frames)
+
+    def read(self):
+        ''' Reads the next frame. '''
+
+        frame = next(self.frames, None)
+        return frame is not None, frame
+
+    def skip(self, count):
+        ''' Skips frames, returning False if the frames ended.
+            @param count: number of frames to skip. '''
+
+        for _ in range(count):
+            if next(self.frames, None) is None:
+                return False
+
+        return True
+
+    def release(self):
+        ''' Stops the generator of the frames, if any. '''
+
+        if hasattr(self.frames, "close"):
+            self.frames.close()
+
+
+class RawPipeReader:
+    ''' Reads raw BGR24 frames of a known size from a binary stream, like the
+        standard input or a named pipe fed by "ffmpeg -f rawvideo -pix_fmt bgr24".
+        Every frame is read into the same buffer, which the frame is a view of. '''
+
+    def __init__(self, stream, width, height, close=True):
+        ''' @param stream: binary stream of frames.
+            @param width, height: size of the frames.
+            @param close: set to True to close the stream when the reader is released. '''
+
+        self.stream = stream
+        self.close = close
+        self.buffer = bytearray(width * height * 3)
+        self.view = memoryview(self.buffer)
+        self.frame = np.frombuffer(self.buffer, np.uint8).reshape(height, width, 3)
+
+    def read(self):
+        ''' Reads the next frame of the stream, waiting until it is complete. '''
+
+        filled = 0
+        while filled < len(self.view):
+            count = self.stream.readinto(self.view[filled:])
+            # End of the stream, an incomplete frame is discarded
+            if not count:
+                return False, None
+            filled += count
+
+        return True, self.frame
+
+    def skip(self, count):
+        ''' Skips frames of the stream, returning False if the stream ended.
+            @param count: number of frames to skip. '''
+
+        for _ in range(count):
+            status, _ = self.read()
+            if status == False:
+                return False
+
+        return True
+
+    def release(self):
+        ''' Closes the stream. '''
+
+        if self.close:
+            self.stream.close()
+
+
+class FFmpegReader(RawPipeReader):
+    ''' Decodes a video with an ffmpeg process that crops the game, scales it and
+        converts it to BGR24, so frames come out of the pipe at their final size
+        instead of being converted, cropped and resized at the size of the video.
+        Seeking restarts the process at the time of the frame, so it is only
+        accurate in videos with a constant frame rate. '''
+
+    def __init__(self, file_path, crop, size, skip_mode=SKIP_GRAB, idle=None):
+        ''' @param file_path: path of the video file.
+            @param crop: (h1, h2, w1, w2) crop of the game in the video.
+            @param size: (width, height) of the frames read.
+            @param skip_mode: SKIP_SEEK restarts the process to skip long timeouts,
+            the other modes read the skipped frames from the pipe.
+            @param idle: seconds without new data after which a file still being written
+            is over, ffmpeg waits at its end until then. None for a finished video. '''
+
+        h1, h2, w1, w2 = crop
+        self.file_path = file_path
+        self.filters = "crop=%d:%d:%d:%d,scale=%d:%d:flags=bilinear" % (w2 - w1, h2 - h1, w1, h1, size[0], size[1])
+        self.skip_mode = skip_mode
+        self.idle = idle
+        video = cv2.VideoCapture(file_path)
+        self.fps = video.get(cv2.CAP_PROP_FPS)
+        video.release()
+        self.process = None
+        # Index of the next frame
+        self.index = 0
+        super().__init__(None, size[0], size[1])
+        self.start(0)
+
+    def start(self, index):
+        ''' Starts the ffmpeg process at a frame, stopping the previous one.
+            @param index: index of the first frame decoded. '''
+
+        self.stop()
+        command = [shutil.which("ffmpeg"), "-nostdin", "-v", "error"]
+        # Half a frame earlier, so rounding never lands on the next frame
+        if index > 0:
+            command += ["-ss", "%.6f" % ((index - 0.5) / self.fps)]
+        # The file protocol keeps reading the end of the file as it grows
+        if self.idle is not None:
+            command += ["-follow", "1", "-rw_timeout", str(int(self.idle * 1000000))]
+        command += ["-i", self.file_path, "-an", "-sn", "-vf", self.filters, "-vsync", "passthrough", "-f", "rawvideo", "-pix_fmt", "bgr24", "-"]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.stream = self.process.stdout
+        self.index = index
+
+    def stop(self):
+        ''' Stops the ffmpeg process, if any. '''
+
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+    def read(self):
+        ''' Reads the next frame of the video. '''
+
+        status, frame = super().read()
+        if status:
+            self.index += 1
+
+        return status, frame
+
+    def skip(self, count):
+        ''' Skips frames of the video, returning False if the video ended.
+            @param count: number of frames to skip. '''
+
+        if self.skip_mode == SKIP_SEEK and count >= SEEK_MIN_FRAMES and self.fps > 0:
+            return self.seek(self.index + count)
+
+        return super().skip(count)
+
+    def seek(self, index):
+        ''' Moves to a frame of the video. The end of the video is only
+            known once the next frame is read.
+            @param index: index of the next frame read. '''
+
+        if self.fps <= 0:
+            return False
+        self.start(index)
+
+        return True
+
+    def release(self):
+        ''' Stops the ffmpeg process. '''
+
+        self.stop()
+
+
+def open_ffmpeg(file_path, crop, size, skip_mode=SKIP_GRAB):
+    ''' Opens a video decoded by ffmpeg straight to the cropped game at its final
+        size, see FFmpegReader. Returns None if ffmpeg isn't installed or if the
+        path isn't a video file, so the caller falls back to open_video().
+        @param file_path: path of the video file.
+        @param crop: (h1, h2, w1, w2) crop of the game in the video.
+        @param size: (width, height) of the frames read.
+        @param skip_mode: how frames are skipped. '''
+
+    if shutil.which("ffmpeg") is None or not os.path.isfile(file_path):
+        return None
+
+    return FFmpegReader(file_path, crop, size, skip_mode)
+
+
+def follow_ffmpeg(file_path, idle=10):
+    ''' Opens a video file that is still being written, decoded by a single ffmpeg process
+        that waits at the end of the file for new frames, so the recording is never decoded
+        twice. The frames keep the size of the video. Returns None if ffmpeg isn't installed
+        or if the size of the video can't be read yet, see GrowingFileReader.
+        @param file_path: path of the video file.
+        @param idle: seconds without new frames after which the video is over. '''
+
+    if shutil.which("ffmpeg") is None or not os.path.isfile(file_path):
+        return None
+    video = cv2.VideoCapture(file_path)
+    width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    video.release()
+    if width <= 0 or height <= 0:
+        return None
+
+    return FFmpegReader(file_path, (0, height, 0, width), (width, height), idle=idle)
+
+
+class GrowingFileReader:
+    ''' Reads a video file that is still being written, like a recording in progress,
+        when ffmpeg isn't installed to follow it, see follow_ffmpeg(). When there are
+        no more frames, the file is reopened at the same frame once it grew, until new
+        frames show up or until nothing was written for a while. Containers that are
+        only readable once finished, like mp4, can't be followed. '''
+
+    def __init__(self, file_path, skip_mode=SKIP_GRAB, poll=0.5, idle=10):
+        ''' @param file_path: path of the video file.
+            @param skip_mode: how frames are skipped.
+            @param poll: seconds waited before checking if the file grew.
+            @param idle: seconds without new frames after which the video is over. '''
+
+        self.file_path = file_path
+        self.skip_mode = skip_mode
+        self.poll = poll
+        self.idle = idle
+        self.video = cv2.VideoCapture(file_path)
+        self.size = os.path.getsize(file_path)
+        # Index of the next frame
+        self.index = 0
+
+    def next_frame(self, decode):
+        ''' Reads or grabs the next frame, waiting for the file to grow.
+            @param decode: set to True to decode the frame. '''
+
+        waited = 0
+        while True:
+            if decode:
+                status, frame = self.video.read()
+            else:
+                status, frame = self.video.grab(), None
+            if status:
+                self.index += 1
+                return True, frame
+            if waited >= self.idle:
+                return False, None
+
+            time.sleep(self.poll)
+            waited += self.poll
+            size = os.path.getsize(self.file_path)
+            if size != self.size:
+                self.size = size
+                self.reopen()
+
+    def reopen(self):
+        ''' Reopens the file, so its new end is read, and seeks back to the next frame.
+            OpenCV can't seek past the number of frames in the index of the container,
+            which unfinished avi and mkv recordings don't have yet. The frames before
+            the next one are then grabbed one by one, which decodes the whole recording
+            again every time it grows. '''
+
+        self.video.release()
+        self.video = cv2.VideoCapture(self.file_path)
+        if self.index == 0:
+            return
+        if self.video.set(cv2.CAP_PROP_POS_FRAMES, self.index) and self.video.get(cv2.CAP_PROP_POS_FRAMES) == self.index:
+            return
+
+        self.video.release()
+        self.video = cv2.VideoCapture(self.file_path)
+        skip_frames(self.video, self.index, SKIP_GRAB)
+
+    def read(self):
+        ''' Reads the next frame of the video. '''
+
+        return self.next_frame(True)
+
+    def skip(self, count):
+        ''' Skips frames of the video, returning False if the video ended.
+            @param count: number of frames to skip. '''
+
+        for _ in range(count):
+            status, _ = self.next_frame(False)
+            if status == False:
+                return False
+
+        return True
+
+    def release(self):
+        ''' Closes the video. '''
+
+        self.video.release()
+
+
+def open_stream(source, skip_mode=SKIP_GRAB, size=None, follow=False):
+    ''' Opens a live source of frames.
+        @param source: index of a capture device, "-" for raw frames in the
+        standard input, or the path of a video file or of a named pipe.
+        @param skip_mode: how frames are skipped.
+        @param size: (width, height) of raw frames, required by the standard
+        input and named pipes, which are read as raw frames.
+        @param follow: set to True to keep reading a video file that is still being written,
+        with ffmpeg if it is installed. '''
+
+    if isinstance(source, int) or source.isdigit():
+        return VideoReader(int(source), SKIP_GRAB)
+    if source == "-" or size is not None:
+        if size is None:
+            raise ValueError("The size of the raw frames is required")
+        if source == "-":
+            return RawPipeReader(sys.stdin.buffer, size[0], size[1], close=False)
+        return RawPipeReader(open(source, "rb"), size[0], size[1])
+    if follow:
+        video = follow_ffmpeg(source)
+        return video if video is not None else GrowingFileReader(source, skip_mode)
+
+    return VideoReader(source, skip_mode)
+
+
+def source_size(video):
+    ''' Size (width, height) of the frames of a source opened by open_stream(),
+        or None if it isn't known before reading.
+        @param video: frame source. '''
+
+    if isinstance(video, RawPipeReader):
+        return video.frame.shape[1], video.frame.shape[0]
+    width = int(video.video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(video.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    return (width, height) if width > 0 and height > 0 else None
+
+
+def open_video(file_path, skip_mode=SKIP_GRAB, queue_depth=0):
+    ''' Opens a video for reading frames, decoding in a separate thread if there is a queue.
+        @param file_path: path of the video file, or of a directory with an image sequence.
+        @param skip_mode: how frames are skipped.
+        @param queue_depth: maximum number of decoded frames waiting to be analyzed. '''
+
+    if os.path.isdir(file_path):
+        return ImageSequenceReader(file_path)
+    if queue_depth > 0:
+        return ThreadedVideoReader(file_path, skip_mode, queue_depth)
+    return VideoReader(file_path, skip_mode)
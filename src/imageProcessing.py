@@ -18,105 +18,48 @@ def detect_edges(img):
     ''' Detects edges from pictures of CTR digits.
         @param img: image of the CTR digit '''
 
-    height, width = img.shape
     # Get the average color of the grayscale image
     color_mean = np.mean(img)
     color_mean *= 1.05
 
-    # Loop every pixel
-    for i in range(height):
-        for j in range(width):
-            # Select the darkest pixels as edges and color them black
-            if img[i, j] >= color_mean:
-                img[i, j] = WHITE
-            else:
-                img[i, j] = BLACK
+    # Select the darkest pixels as edges and color them black
+    img[...] = np.where(img >= color_mean, WHITE, BLACK)
 
     return img
 
 
+def first_black_pixels(img):
+    ''' Finds, for every line of the image, the distance from the border to the
+        first black pixel, searching only half of the line to prevent detecting
+        black pixels in case of the image having holes.
+        Returns the sum of the distances found and the number of lines that had one.
+        @param img: image of the CTR digit, with the border on the first column '''
+
+    black = img[:, :img.shape[1] // 2] == BLACK
+    found = black.any(axis=1)
+    distances = black.argmax(axis=1)
+
+    return int(distances[found].sum()), int(found.sum())
+
+
 def add_border(img):
     ''' Add a black border surrounding the digit, removing noise.
         @param img: image of the CTR digit '''
 
-    height, width = img.shape
-
-    # Calculating the mean distance of the border to the
+    # Calculating the mean distance of each border to the
     # black pixels surrounding the number
-    left_mean = 0
-    right_mean = 0
-    # Number of valid black pixels detected
-    right_row = 0
-    left_row = 0
-
-    # Looping every height
-    # since we're starting with the right and left border
-    for i in range(height):
-        visited_left = False
-        visited_right = False
-
-        # Looping half of the width pixels to prevent
-        # detecting black pixels in case of the image having holes
-        # surrounding the edges of the number
-        for j in range(width // 2):
-
-            # If a black pixel is detected, j is its distance to the border
-            # Lock the loop from detecting further pixels
-            # by toogling the visited boolean
-            if not visited_right and img[i, width - 1 - j] == BLACK:
-                right_mean += j
-                right_row += 1
-                visited_right = True
-
-            if not visited_left and img[i, j] == BLACK:
-                left_mean += j
-                left_row += 1
-                visited_left = True
-
-            # If both blacks were found, we can go to the next height
-            if visited_left and visited_right:
-                break
-
-    # Same code as before, but now for the up and down sides
-    up_mean = 0
-    up_row = 0
-    down_mean = 0
-    down_row = 0
-    for i in range(width):
-        visited_up = False
-        visited_down = False
-
-        for j in range(height // 2):
-            if not visited_down and img[height - 1 - j, i] == BLACK:
-                down_mean += j
-                down_row += 1
-                visited_down = True
-
-            if not visited_up and img[j, i] == BLACK:
-                up_mean += j
-                up_row += 1
-                visited_up = True
-
-            if visited_down and visited_up:
-                break
+    left_mean, left_row = first_black_pixels(img)
+    right_mean, right_row = first_black_pixels(img[:, ::-1])
+    up_mean, up_row = first_black_pixels(img.T)
+    down_mean, down_row = first_black_pixels(img.T[:, ::-1])
 
     # We're safe to assume that the entire rectangle from the border
     # to the average value of the first black pixel is noise.
     # Thus, we remove it by making the entire rectangle be black.
-
-    # Left and right sides
-    for i in range(height):
-        for j in range(max(right_mean // right_row, 1)):
-            img[i, width - 1 - j] = BLACK
-        for j in range(max(left_mean // left_row, 1)):
-            img[i, j] = BLACK
-
-    # Up and down sides
-    for i in range(width):
-        for j in range(max(down_mean // down_row, 1)):
-            img[height - 1 - j, i] = BLACK
-        for j in range(max(up_mean // up_row, 1)):
-            img[j, i] = BLACK
+    img[:, :max(left_mean // left_row, 1)] = BLACK
+    img[:, img.shape[1] - max(right_mean // right_row, 1):] = BLACK
+    img[:max(up_mean // up_row, 1), :] = BLACK
+    img[img.shape[0] - max(down_mean // down_row, 1):, :] = BLACK
 
     return img
 
@@ -189,7 +132,7 @@ def paint_colored_area(img, pixel, color_area, color_paint, diagonal=True):
 
 def detect_colored_areas(img, color_area, color_paint, color_rejected, size=150, diagonal=True):
     ''' Detects colored areas in a picture. This function doesn't check the pixels
-        in the border of the picture.
+        in the border of the picture. Flood fill reference of remove_small_areas.
         @param img: image that you want to extract the areas.
         @param color_area: color of the areas that you want to find.
         @param color_paint: color that you want to paint the area.
@@ -225,19 +168,45 @@ def detect_colored_areas(img, color_area, color_paint, color_rejected, size=150,
     return areas
 
 
+def remove_small_areas(img, color_area, color_rejected, size=150, diagonal=True):
+    ''' Paints every colored area smaller than the threshold size, labeling all
+        the areas of the picture in a single pass. Same results as detect_colored_areas,
+        as long as the border of the picture doesn't have color_area.
+        @param img: image that you want to clean up.
+        @param color_area: color of the areas that you want to find.
+        @param color_rejected: color to paint every area that has color_area, but
+        is less than your threshold size.
+        @param size: minimum number of pixels required to be considered an area.
+        @param diagonal: set to True if you want to consider pixels in
+        surrounding the diagonals as neighbors '''
+
+    height, width = img.shape
+    # If the digit size is small, use a smaller threshold
+    if height == DIGIT_HEIGHT:
+        size = 20
+
+    # Label every area of the picture, label 0 being everything that isn't color_area
+    mask = (img == color_area).astype(np.uint8)
+    _, labels = cv2.connectedComponents(mask, connectivity=8 if diagonal else 4)
+
+    # Histogram of the labels gives the number of pixels in each area
+    rejected = np.bincount(labels.ravel()) < size
+    rejected[0] = False
+    img[rejected[labels]] = color_rejected
+
+    return img
+
+
 def remove_noisy_areas(img):
     ''' Removes small white pixel areas from the picture.
-        @param img: image of the CTR digit.
-        @param size: size of the area. '''
+        @param img: image of the CTR digit. '''
 
     height, width = img.shape
 
     # Remove the smaller areas of the image. Default threshold is 150 pixels.
     # Areas too small usually are just noise, so removing helps cleaning up the image,
     # which helps predicting the right number.
-    areas = detect_colored_areas(img, WHITE, GRAY, BLACK)
-    for area in areas:
-        paint_colored_area(img, area[0], GRAY, WHITE)
+    img = remove_small_areas(img, WHITE, BLACK)
 
     # Dilate each white part of the picture. This helps witH glueing parts of the number
     # which are separated by a few black pixels, and also removes a bit of remaining noise.
@@ -247,47 +216,25 @@ def remove_noisy_areas(img):
     if height != DIGIT_HEIGHT:
 
         # Adding a black border to the image
-        for i in range(width):
-            img[0, i] = BLACK
-            img[height - 1, i] = BLACK
-        for i in range(height):
-            img[i, 0] = BLACK
-            img[i, width - 1] = BLACK
+        img[[0, height - 1], :] = BLACK
+        img[:, [0, width - 1]] = BLACK
 
         # Our dataset consists of CTR digits, which are unique and never changes.
         # However, depending on the capture card quality, the alligment of the Y axis
         # does change from video to video. So, in order to fix it and help getting a more
         # accurate prediction, I'm alligning the number with the top of the picture.
 
-        # Variable to store the distance from the first WHITE pixel in the Y axis
-        fix_height = 0
-        # Looping every pixel, ignoring the border
-        for i in range(1, height):
-            found = False
-            for j in range(1, width - 1):
-
-                # Whenever you find a white pixel, the distance from where you start will be
-                # y = the current height - 1, since we ignore the border
-                if img[i, j] == WHITE:
-                    fix_height = i - 1
-                    found = True
-                    break
-
-            if found:
-                break
+        # Distance from the first row with a WHITE pixel to the top, ignoring the border
+        white_rows = (img[1:, 1:width - 1] == WHITE).any(axis=1)
+        fix_height = int(white_rows.argmax()) if white_rows.any() else 0
 
         # If the distance from the first white pixel needs to be adjusted
         if fix_height > 0:
 
-            # Move all pixels up, ignoring the border
-            for i in range(1, height - fix_height):
-                for j in range(1, width - 1):
-                    img[i, j] = img[i + fix_height, j]
-
-            # Erase the remaining pixels by painting them as BLACK
-            for i in range(height - fix_height, height):
-                for j in range(width):
-                    img[i, j] = BLACK
+            # Move all pixels up, ignoring the border, and erase
+            # the remaining pixels by painting them as BLACK
+            img[1:, 1:width - 1] = np.roll(img[1:, 1:width - 1], -fix_height, axis=0)
+            img[height - fix_height:, :] = BLACK
 
     return img
 
@@ -300,4 +247,4 @@ def process_digit(digit):
     digit = add_border(digit)
     digit = remove_noisy_areas(digit)
 
-    return digit
\ No newline at end of file
+    return digit
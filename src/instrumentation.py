@@ -0,0 +1,93 @@
+import cProfile
+import threading
+
+# Events reported by the pipeline to an observer, a function called with
+# the name and the value of each event. Counters are reported by each scan
+# once it is done, the other events as soon as they happen.
+#   frames_decoded: frames decoded by a scan, read or only grabbed between the samples
+#   frames_grabbed: frames between the samples of the coarse to fine search, decoded
+#   by the source but never converted to pictures nor checked
+#   frames_skipped: frames skipped by the timeouts after the races
+#   samples: frames checked by the coarse to fine search between the rescans
+#   rescans: samples that looked like the end of a race, whose frames were checked one by one
+#   flash_candidates: frames whose corners were bright enough to be checked for a flash
+#   flashes: white flashes found
+#   probe_hits, probe_misses: frames after a flash with and without the end of race colors
+#   igt_candidates: in game time pictures kept after each flash
+#   digit_seconds: time processing each digit
+#   model_seconds: time of each call to the model
+#   digits_predicted: digits predicted by each call to the model
+#   races: races read
+#   realigned: races far from the model, read again with the alignments measured on their digits
+
+
+class ProfileObserver:
+    ''' Observer that sums, counts and keeps the maximum value of each event.
+        Events can come from the scan and from the threads reading the races at once. '''
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self.maximums = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, event, value=1):
+        ''' Records an event.
+            @param event: name of the event.
+            @param value: value of the event. '''
+
+        with self.lock:
+            if event in self.totals:
+                self.totals[event] += value
+                self.counts[event] += 1
+                self.maximums[event] = max(self.maximums[event], value)
+            else:
+                self.totals[event] = value
+                self.counts[event] = 1
+                self.maximums[event] = value
+
+    def summary(self):
+        ''' Total, number, mean and maximum value of each event. '''
+
+        with self.lock:
+            return {
+                event: {
+                    "total": self.totals[event],
+                    "count": self.counts[event],
+                    "mean": self.totals[event] / self.counts[event],
+                    "max": self.maximums[event],
+                }
+                for event in sorted(self.totals)
+            }
+
+    def report(self):
+        ''' Summary as lines of text. '''
+
+        lines = []
+        for event, values in self.summary().items():
+            lines.append("%s: total=%s, count=%d, mean=%s, max=%s" % (
+                event, format_value(values["total"]), values["count"], format_value(values["mean"]), format_value(values["max"])
+            ))
+
+        return "\n".join(lines)
+
+
+def format_value(value):
+    ''' Formats the value of an event, times with microseconds.
+        @param value: int or float. '''
+
+    return ("%.6f" % value) if isinstance(value, float) else str(value)
+
+
+def profile_call(output, function, *args):
+    ''' Calls a function under cProfile, writing the trace to a file
+        that can be read with pstats or snakeviz.
+        @param output: path of the trace file.
+        @param function: function to call.
+        @param args: arguments of the function. '''
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(output)
@@ -1,9 +1,12 @@
+import argparse
 import curses
+import multiprocessing
 from cv2 import imshow, destroyAllWindows, waitKey
 
-from sys import argv
 from time import sleep
 
+from cropDetection import *
+from instrumentation import *
 from videoProcessing import *
 
 
@@ -165,28 +168,7 @@ def calculate_igt(stdscr, times):
         @param stdscr: standart screen of curses.
         @param times: every digit of each lap time of the speedrun. '''
 
-    # Variables to store the total time in h:min:s.ms
-    hours = 0
-    minutes = 0
-    seconds = 0
-    miliseconds = 0
-
-    # Looping each lap in each course
-    for lap_times in times:
-        # Since there are three laps by course, sum one lap at a time
-        for i in range(3):
-            miliseconds += lap_times[4 + i * 5] + (10 * lap_times[3 + i * 5])
-            if miliseconds > 99:
-                seconds += (miliseconds // 100)
-                miliseconds = miliseconds % 100
-            seconds += lap_times[2 + i * 5] + (10 * lap_times[1 + i * 5])
-            if seconds > 59:
-                minutes += (seconds // 60)
-                seconds = seconds % 60
-            minutes += lap_times[0 + i * 5]
-            if minutes > 59:
-                hours += (minutes // 60)
-                minutes = minutes % 60
+    hours, minutes, seconds, miliseconds = calculate_total(times)
 
     # Outputting the result to the user
     stdscr.clear()
@@ -198,13 +180,24 @@ def calculate_igt(stdscr, times):
     else:
         stdscr.addstr(0, 0, "Your in game time is: "+str(hours)+zero_minute+str(minutes)+":"+zero_second+str(seconds)+"."+zero_milisecond+str(miliseconds))
 
-def main(stdscr):
+def parse_arguments():
+    ''' Parses the command line arguments of the program. '''
+
+    parser = argparse.ArgumentParser(description="Finds the in game time of a Crash Team Racing speedrun.")
+    parser.add_argument("run_path", nargs="?", help="path to the speedrun video")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes scanning the video")
+    parser.add_argument("--queue-depth", type=int, default=0, help="number of frames decoded ahead in a separate thread, 0 to decode in the same thread")
+    parser.add_argument("--profile", action="store_true", help="print a summary of the counters and timings of the pipeline once the program is closed")
+    parser.add_argument("--profile-output", help="file where a cProfile trace of the whole program is written")
+
+    return parser.parse_args()
 
-    # Getting the path of the speedrun file
-    try:
-        run_path = argv[1]
 
-    except IndexError:
+def main(stdscr, args):
+
+    # Getting the path of the speedrun file
+    run_path = args.run_path
+    if run_path is None:
 
         # If there is no file, show error and tell user how to fix the issue
         stdscr.addstr(0, 0, "ERROR: No file was passed as an argument. Please call this program with the path to the speedrun video, or drag the video in the executable.\n\nPress ENTER to quit the program.")
@@ -219,7 +212,7 @@ def main(stdscr):
     curses.curs_set(0)
     # If there is a file, display the main screen of the software
     # and instruction of how to proceed
-    stdscr.addstr(0, 0, "╔═╗╔╦╗╦═╗   ╔═╗┬ ┬┌┬┐┌─┐╦╔═╗╔╦╗\n║   ║ ╠╦╝───╠═╣│ │ │ │ │║║ ╦ ║\n╚═╝ ╩ ╩╚═   ╩ ╩└─┘ ┴ └─┘╩╚═╝ ╩ v1.0\n\nPress ENTER to start cropping the game. Use the WASD keys to adjust the game window.\nIf you need to reset the window, press ESC at any time. Once you're done, press ENTER to submit.\nQ quits the program.")
+    stdscr.addstr(0, 0, "╔═╗╔╦╗╦═╗   ╔═╗┬ ┬┌┬┐┌─┐╦╔═╗╔╦╗\n║   ║ ╠╦╝───╠═╣│ │ │ │ │║║ ╦ ║\n╚═╝ ╩ ╩╚═   ╩ ╩└─┘ ┴ └─┘╩╚═╝ ╩ v1.0\n\nPress ENTER to start. The game window is detected automatically. If the detection fails, you will crop the game\nusing the WASD keys to adjust the game window. If you need to reset the window, press ESC at any time.\nOnce you're done, press ENTER to submit.\nQ quits the program.")
     stdscr.refresh()
 
     while True:
@@ -228,20 +221,35 @@ def main(stdscr):
         # When the user chooses to proceed
         if key == curses.KEY_ENTER or key in [10, 13]:
 
-            # Open the interface to crop the game in the speedrun
-            h1, h2, w1, w2 = crop_video(run_path)
-            # Open the menu to select the game region
-            version = open_menu(stdscr, "What version was this run played on?", ("NTSC-U", "PAL", "NTSC-J"))
+            # Detect the game in the speedrun. If the detection isn't
+            # confident, open the interface to crop the game manually
+            stdscr.clear()
+            stdscr.addstr(0, 0, "Detecting the game window...")
+            stdscr.refresh()
+            crop, confidence = detect_crop(run_path)
+            if confidence >= CROP_CONFIDENCE:
+                h1, h2, w1, w2 = crop
+            else:
+                h1, h2, w1, w2 = crop_video(run_path)
+            # Open the menu to select the game region, or detect it on the first race
+            version = open_menu(stdscr, "What version was this run played on?", VERSIONS + ("Auto-detect",))
+            if version == len(VERSIONS):
+                version = None
             # Open the menu to select the run category
-            category = open_menu(stdscr, "What is the category of this speedrun?", ("Any% Warpless", "All Cups"))
+            category = open_menu(stdscr, "What is the category of this speedrun?", CATEGORIES)
             # Tell the user that you're trying to find the in game time
             stdscr.clear()
             stdscr.addstr(0, 0, "Analizing the speedrun...")
             stdscr.refresh()
             # Get every single in game time and predict the digits
-            times, igt = process_video(run_path, h1, h2, w1, w2, version, category, stdscr)
+            # The scan is checkpointed after every race, so it resumes if the program is interrupted.
+            # Videos already processed are read from the cache, going straight to the verification
+            checkpoint = checkpoint_path(run_path)
+            times, igt, _ = process_video(run_path, h1, h2, w1, w2, version, category, stdscr, workers=args.workers, queue_depth=args.queue_depth, checkpoint=checkpoint, cache_dir=CACHE_DIR, observer=args.observer)
             # Open the menu for the user to verify the IGT
             times = verify_igt(stdscr, times, igt)
+            # The results are verified, the checkpoint isn't needed anymore
+            remove_checkpoint(checkpoint)
             # Calculate and displays the final in game time on the terminal
             calculate_igt(stdscr, times)
 
@@ -259,4 +267,15 @@ def main(stdscr):
             return
 
 
-curses.wrapper(main)
\ No newline at end of file
+if __name__ == "__main__":
+    # Worker processes of the parallel scan must not open the interface again
+    multiprocessing.freeze_support()
+    args = parse_arguments()
+    args.observer = ProfileObserver() if args.profile else None
+    if args.profile_output is not None:
+        profile_call(args.profile_output, curses.wrapper, main, args)
+    else:
+        curses.wrapper(main, args)
+    # The summary is printed once curses gave the terminal back
+    if args.observer is not None:
+        print(args.observer.report())
\ No newline at end of file
@@ -0,0 +1,159 @@
+import cv2
+import hashlib
+import json
+import numpy as np
+import os
+
+from digitModel import COMPACT_MODEL_PATH, MODEL_PATH
+
+# Directory of the cache, one subdirectory per processed video
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "CTR-AutoIGT")
+# Maximum size of the cache in bytes, the least recently used results are evicted
+CACHE_SIZE = 256 * 1024 * 1024
+CACHE_VERSION = 1
+# Size of each block of the file read by the partial hash
+HASH_BLOCK = 1024 * 1024
+
+
+def partial_hash(file_path):
+    ''' Fast hash of a file, reading only its size and a block at
+        its start, its middle and its end.
+        @param file_path: path of the file, or of a directory with an image sequence. '''
+
+    # Image sequences are identified by the names and sizes of their pictures
+    if os.path.isdir(file_path):
+        listing = [name + ":" + str(os.path.getsize(os.path.join(file_path, name))) for name in sorted(os.listdir(file_path))]
+        return hashlib.blake2b("\n".join(listing).encode(), digest_size=16).hexdigest()
+
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, "rb") as file:
+        for offset in (0, max(0, size // 2 - HASH_BLOCK // 2), max(0, size - HASH_BLOCK)):
+            file.seek(offset)
+            digest.update(file.read(HASH_BLOCK))
+
+    return digest.hexdigest()
+
+
+def model_hash():
+    ''' Hash of the model file used by load_model(), so the results
+        predicted by another model are invalidated. '''
+
+    for file_path in (COMPACT_MODEL_PATH, MODEL_PATH):
+        if os.path.exists(file_path):
+            return partial_hash(file_path)
+
+    return ""
+
+
+def cache_key(file_path, h1, h2, w1, w2, version, category, ffmpeg=False, realign=False):
+    ''' Identifies the result of a video processed with a crop, region and category.
+        @param file_path: path of the video file.
+        @param h1, h2, w1, w2: crop of the game in the video.
+        @param version: index of the game region, None if it is detected.
+        @param category: settings of the run category, see category_key().
+        @param ffmpeg: whether ffmpeg decodes the video, which scales the frames differently.
+        @param realign: whether the races far from the model are read again. '''
+
+    settings = "%d:%s:%d,%d,%d,%d:%s:%s:%d:%d" % (CACHE_VERSION, partial_hash(file_path), h1, h2, w1, w2, version, category, ffmpeg, realign)
+
+    return hashlib.blake2b(settings.encode(), digest_size=16).hexdigest()
+
+
+def entry_size(entry):
+    ''' Size in bytes of the files of a cache entry.
+        @param entry: path of the entry directory. '''
+
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+
+def remove_entry(entry):
+    ''' Deletes a cache entry.
+        @param entry: path of the entry directory. '''
+
+    for name in os.listdir(entry):
+        os.remove(os.path.join(entry, name))
+    os.rmdir(entry)
+
+
+def load_result(key, cache_dir=CACHE_DIR):
+    ''' Reads a cached result, or returns None if it isn't cached or if it
+        was predicted by another model. Returns a dictionary with the digits,
+        the in game time pictures and the distances of each race, the frame
+        indices where each race was found and the detected region.
+        @param key: return of cache_key().
+        @param cache_dir: directory of the cache. '''
+
+    entry = os.path.join(cache_dir, key)
+    try:
+        with open(os.path.join(entry, "result.json"), "r") as file:
+            result = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    # The digits were predicted by another model
+    if result["model"] != model_hash():
+        remove_entry(entry)
+        return None
+
+    igt = []
+    for i in range(len(result["times"])):
+        img = cv2.imread(os.path.join(entry, "igt%d.png" % i), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None
+        igt.append(img)
+    result["igt"] = igt
+    result["distances"] = [np.array(race_distances) for race_distances in result["distances"]]
+
+    # Marking the entry as recently used
+    os.utime(entry)
+
+    return result
+
+
+def store_result(key, result, cache_dir=CACHE_DIR, max_size=CACHE_SIZE):
+    ''' Writes a result in the cache, with its in game time pictures compressed
+        as PNG, then evicts the least recently used results above the size limit.
+        @param key: return of cache_key().
+        @param result: dictionary like the return of load_result().
+        @param cache_dir: directory of the cache.
+        @param max_size: maximum size of the cache in bytes. '''
+
+    entry = os.path.join(cache_dir, key)
+    os.makedirs(entry, exist_ok=True)
+    for i in range(len(result["igt"])):
+        cv2.imwrite(os.path.join(entry, "igt%d.png" % i), result["igt"][i])
+
+    data = {
+        "model": model_hash(),
+        "times": [[int(digit) for digit in race_times] for race_times in result["times"]],
+        "distances": [np.asarray(race_distances).tolist() for race_distances in result["distances"]],
+        "frames": [[int(index) for index in frames] for frames in result["frames"]],
+        "version": result["version"],
+        "version_margin": result["version_margin"],
+    }
+    # The result is written last, so an interrupted write is never loaded
+    temporary = os.path.join(entry, "result.json.tmp")
+    with open(temporary, "w") as file:
+        json.dump(data, file)
+    os.replace(temporary, os.path.join(entry, "result.json"))
+
+    evict(cache_dir, max_size)
+
+
+def evict(cache_dir=CACHE_DIR, max_size=CACHE_SIZE):
+    ''' Removes the least recently used results until the cache fits in its size limit.
+        @param cache_dir: directory of the cache.
+        @param max_size: maximum size of the cache in bytes. '''
+
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    entries = sorted((entry for entry in entries if os.path.isdir(entry)), key=os.path.getmtime)
+    sizes = [entry_size(entry) for entry in entries]
+    total = sum(sizes)
+
+    # The most recent result is always kept
+    for entry, size in zip(entries[:-1], sizes[:-1]):
+        if total <= max_size:
+            break
+        remove_entry(entry)
+        total -= size
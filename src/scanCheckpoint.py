@@ -0,0 +1,114 @@
+import hashlib
+import numpy as np
+import os
+
+# Directory of the checkpoints, beside the cache so the videos can be in read-only directories
+CHECKPOINT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "CTR-AutoIGT-checkpoints")
+# Extension of the checkpoint files
+CHECKPOINT_EXTENSION = ".checkpoint.npz"
+CHECKPOINT_VERSION = 3
+
+
+def checkpoint_path(file_path, checkpoint_dir=CHECKPOINT_DIR):
+    ''' Path of the checkpoint file of a video, named after the absolute path of the video.
+        @param file_path: path of the video file.
+        @param checkpoint_dir: directory of the checkpoints. '''
+
+    name = hashlib.blake2b(os.path.abspath(file_path).encode(), digest_size=16).hexdigest()
+
+    return os.path.join(checkpoint_dir, name + CHECKPOINT_EXTENSION)
+
+
+def checkpoint_key(file_path, h1, h2, w1, w2, version, category, defer_prediction, ffmpeg=False, realign=False):
+    ''' Identifies the video and the settings of a scan, so a checkpoint
+        is only resumed by a scan that would have found the same races.
+        @param file_path: path of the video file.
+        @param h1, h2, w1, w2: crop of the game in the video.
+        @param version: index of the game region, None if it is detected.
+        @param category: settings of the run category, see category_key().
+        @param defer_prediction: whether the predictions are deferred.
+        @param ffmpeg: whether ffmpeg decodes the video, which scales the frames differently.
+        @param realign: whether the races far from the model are read again. '''
+
+    # A file replaced by another one, even of the same size, has another modification time
+    info = os.stat(file_path)
+    return "%d:%d:%d:%d,%d,%d,%d:%s:%s:%d:%d:%d" % (
+        CHECKPOINT_VERSION, info.st_size, info.st_mtime_ns, h1, h2, w1, w2, version, category, defer_prediction, ffmpeg, realign
+    )
+
+
+def save_checkpoint(path, key, state):
+    ''' Writes the state of a scan. The file is replaced atomically,
+        so an interruption while writing keeps the previous checkpoint.
+        Returns False if the checkpoint couldn't be written.
+        @param path: path of the checkpoint file.
+        @param key: return of checkpoint_key().
+        @param state: dictionary with the position of the scan, the alignment
+        each race was read with, the results of the races found and their frames. '''
+
+    temporary = path + ".tmp"
+    # A directory that can't be written only disables the checkpoints
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(temporary, "wb") as file:
+            np.savez(
+                file,
+                key=np.array(key),
+                index=np.array(state["index"]),
+                igt_found=np.array(state["igt_found"]),
+                width_estimates=np.array(state["width_estimates"], np.int64),
+                # -1 while the region isn't known
+                version=np.array(-1 if state["version"] is None else state["version"]),
+                version_margin=np.array(state["version_margin"]),
+                done=np.array(state["done"]),
+                igt=np.array(state["igt"], np.uint8),
+                times=np.array(state["times"], np.int64),
+                distances=np.array(state["distances"], np.float64),
+                pending=np.array(state["pending"], np.uint8),
+                frames=np.array(state["frames"], np.int64).reshape(-1, 2),
+            )
+        os.replace(temporary, path)
+    except OSError:
+        return False
+
+    return True
+
+
+def load_checkpoint(path, key):
+    ''' Reads the state of a scan, or returns None if there is no checkpoint
+        or if it was written by a scan of another video or with other settings.
+        @param path: path of the checkpoint file.
+        @param key: return of checkpoint_key(). '''
+
+    try:
+        data = np.load(path)
+    except (OSError, ValueError):
+        return None
+
+    with data:
+        if "key" not in data or str(data["key"]) != key:
+            return None
+        version = int(data["version"])
+        return {
+            "index": int(data["index"]),
+            "igt_found": int(data["igt_found"]),
+            "width_estimates": data["width_estimates"].tolist(),
+            "version": None if version < 0 else version,
+            "version_margin": float(data["version_margin"]),
+            "done": bool(data["done"]),
+            "igt": list(data["igt"]),
+            "times": data["times"].tolist(),
+            "distances": list(data["distances"]),
+            "pending": [list(race_digits) for race_digits in data["pending"]],
+            "frames": data["frames"].tolist(),
+        }
+
+
+def remove_checkpoint(path):
+    ''' Deletes a checkpoint once its results are no longer needed.
+        @param path: path of the checkpoint file. '''
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
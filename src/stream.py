@@ -0,0 +1,47 @@
+import argparse
+import json
+import sys
+
+from batch import option_index, run_category
+from videoProcessing import *
+
+
+def parse_arguments():
+    ''' Parses the command line arguments of the live processing. '''
+
+    parser = argparse.ArgumentParser(description="Finds the in game time of a Crash Team Racing speedrun while it is played, printing each race as a JSON line.")
+    parser.add_argument("source", help="index of a capture device, - for raw frames in the standard input, or the path of a video file or of a named pipe")
+    parser.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), help="size of raw BGR24 frames, read from the standard input or a named pipe")
+    parser.add_argument("--follow", action="store_true", help="keep reading a video file that is still being recorded")
+    parser.add_argument("--crop", type=int, nargs=4, metavar=("H1", "H2", "W1", "W2"), help="crop of the game in the frames, the whole frame if not given")
+    parser.add_argument("--version", default="auto", help="game region: " + ", ".join(VERSIONS) + ", or auto to detect it on the first race")
+    parser.add_argument("--category", default=CATEGORIES[0], help="run category: " + ", ".join(CATEGORIES).replace("%", "%%"))
+    parser.add_argument("--races", type=int, help="number of races of the run, replacing the one of the category")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    video = open_stream(args.source, size=args.size, follow=args.follow)
+
+    if args.crop is not None:
+        h1, h2, w1, w2 = args.crop
+    else:
+        size = source_size(video)
+        if size is None:
+            video.release()
+            print("The size of the frames is unknown, pass the crop with --crop.", file=sys.stderr)
+            return 1
+        h1, h2, w1, w2 = 0, size[1], 0, size[0]
+
+    # Each race is printed as soon as it is recognized
+    category = run_category(option_index(args.category, CATEGORIES), args.races)
+    for race in stream_video(video, h1, h2, w1, w2, option_index(args.version, VERSIONS), category):
+        print(json.dumps(race), flush=True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import argparse
+import cv2
+import json
+import numpy as np
+import os
+import sys
+import zipfile
+
+from videoProcessing import *
+
+# Dataset of CTR digits rendered in the synthetic in game time screens
+DATASET_PATH = "MachineLearning/data.zip"
+LABELS_PATH = "MachineLearning/labels.txt"
+
+# Frames of gameplay between the end of two races, the white flash
+# and the end of race screen, and of gameplay after the last race
+GAMEPLAY_FRAMES = 2250
+FLASH_FRAMES = 3
+RESULTS_FRAMES = 147
+TAIL_FRAMES = 2400
+# Gameplay is drawn as flat pictures whose brightness changes every few frames
+GAMEPLAY_PERIOD = 30
+# Colors of the end of race screen, in BGR
+BACKGROUND_COLOR = 90
+FLASH_COLOR = 250
+X_BUTTON_COLOR = (255, 120, 30)
+NUMBER_ONE_COLOR = (0, 220, 255)
+DIGIT_COLOR = 210
+
+
+def load_dataset(file_path=DATASET_PATH):
+    ''' Loads every digit of the machine learning dataset as grayscale images.
+        @param file_path: path of the zipped dataset. '''
+
+    digits = []
+    with zipfile.ZipFile(file_path) as dataset:
+        # Sorting by the image index, so the order matches labels.txt
+        names = [name for name in dataset.namelist() if name.endswith(".png")]
+        names.sort(key=lambda name: int(name[name.index("img") + 3 : -4]))
+        for name in names:
+            buffer = np.frombuffer(dataset.read(name), np.uint8)
+            digits.append(cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE))
+
+    return digits
+
+
+def load_labels(file_path=LABELS_PATH):
+    ''' Loads the number of each digit of the dataset.
+        @param file_path: path of the labels file, with one character per digit. '''
+
+    with open(file_path, "r") as file:
+        return [int(label) for label in file.read().strip()]
+
+
+class SyntheticRun:
+    ''' Deterministic synthetic speedrun: flat gameplay frames, then for every race
+        a white flash and an end of race screen with the blue X button, the yellow "1"
+        and the lap times drawn with digits of the dataset. '''
+
+    def __init__(self, races=3, size=(480, 360), version=0, noise=6, seed=0, variety=False):
+        ''' @param races: number of races.
+            @param size: (width, height) of the frames.
+            @param version: index of the game region, which sets the layout of the screen.
+            @param noise: maximum amplitude of the noise added to the end of race screen.
+            @param seed: seed of the random lap times, digits and noise.
+            @param variety: set to True to draw each digit with a random picture of
+            the dataset, some of which the model misreads. Otherwise every number is
+            drawn with its first picture, so the lap times are read exactly. '''
+
+        self.races = races
+        self.size = size
+        self.version = version
+        self.noise = noise
+        self.seed = seed
+
+        # Pictures of each number in the dataset
+        self.digits = [[] for _ in range(10)]
+        for digit, label in zip(load_dataset(), load_labels()):
+            if variety or len(self.digits[label]) == 0:
+                self.digits[label].append(digit)
+
+        # Lap times of every race, in the order of the in game time digits.
+        # Laps take less than a minute, like the real ones, since a 1 in the
+        # first digit of the run breaks the alignment of the digits
+        rng = np.random.default_rng(seed)
+        self.times = []
+        for _ in range(races):
+            race_times = []
+            for _ in range(3):
+                race_times += [0, int(rng.integers(0, 6))] + [int(digit) for digit in rng.integers(0, 10, 3)]
+            self.times.append(race_times)
+
+    def frame_count(self):
+        ''' Number of frames of the run. '''
+
+        return self.races * (GAMEPLAY_FRAMES + FLASH_FRAMES + RESULTS_FRAMES) + TAIL_FRAMES
+
+    def flash_indices(self):
+        ''' Index of the first white frame of each race. '''
+
+        return [race * (GAMEPLAY_FRAMES + FLASH_FRAMES + RESULTS_FRAMES) + GAMEPLAY_FRAMES for race in range(self.races)]
+
+    def results_screen(self, race, rng):
+        ''' Draws the end of race screen of a race, in the size of the game.
+            @param race: index of the race.
+            @param rng: random generator of the digits and the noise. '''
+
+        screen = np.full((GAME_SIZE[1], GAME_SIZE[0], 3), BACKGROUND_COLOR, np.uint8)
+        for coord, color in ((X_BUTTON_COORD, X_BUTTON_COLOR), (NUMBER_ONE_COORD, NUMBER_ONE_COLOR)):
+            y1, y2, x1, x2 = coord[self.version]
+            screen[y1:y2, x1:x2] = color
+
+        # Every digit is a picture of its number from the dataset
+        igt = screen[IGT_COORD[self.version][0] : IGT_COORD[self.version][1], IGT_COORD[self.version][2] : IGT_COORD[self.version][3]]
+        for i in range(3):
+            y1 = 26 * i + ROW_COORD[self.version][2 * i]
+            y2 = 26 * i + ROW_COORD[self.version][2 * i + 1]
+            for j in range(5):
+                x1, x2 = DIGIT_COORD[j][self.version]
+                pictures = self.digits[self.times[race][i * 5 + j]]
+                digit = cv2.resize(pictures[int(rng.integers(0, len(pictures)))], (x2 - x1, y2 - y1))
+                igt[y1:y2, x1:x2][digit > 127] = DIGIT_COLOR
+
+        if self.noise > 0:
+            noise = rng.integers(-self.noise, self.noise + 1, screen.shape)
+            screen = np.clip(screen.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+        return screen
+
+    def frames(self):
+        ''' Generates every frame of the run, in the size of the video. '''
+
+        rng = np.random.default_rng(self.seed + 1)
+        gameplay = np.empty((self.size[1], self.size[0], 3), np.uint8)
+        flash = np.full((self.size[1], self.size[0], 3), FLASH_COLOR, np.uint8)
+
+        for race in range(self.races + 1):
+            frame_count = GAMEPLAY_FRAMES if race < self.races else TAIL_FRAMES
+            for i in range(frame_count):
+                if i % GAMEPLAY_PERIOD == 0:
+                    gameplay[:] = 40 + int(rng.integers(0, 30)) * 4
+                yield gameplay
+
+            if race == self.races:
+                break
+            for _ in range(FLASH_FRAMES):
+                yield flash
+            screen = cv2.resize(self.results_screen(race, rng), self.size)
+            for _ in range(RESULTS_FRAMES):
+                yield screen
+
+
+def write_run(run, path, fps=60):
+    ''' Writes a synthetic run as a video, or as an image sequence
+        if the path is a directory or has no extension.
+        @param run: SyntheticRun.
+        @param path: path of the video file or of the directory of pictures.
+        @param fps: frame rate of the video. '''
+
+    if os.path.isdir(path) or os.path.splitext(path)[1] == "":
+        os.makedirs(path, exist_ok=True)
+        for i, frame in enumerate(run.frames()):
+            cv2.imwrite(os.path.join(path, "frame%06d.png" % i), frame)
+        return
+
+    video = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, run.size)
+    for frame in run.frames():
+        video.write(frame)
+    video.release()
+
+
+def parse_arguments():
+    ''' Parses the command line arguments of the synthetic run generator. '''
+
+    parser = argparse.ArgumentParser(description="Generates a synthetic Crash Team Racing speedrun, printing its lap times as JSON.")
+    parser.add_argument("output", help="path of the video, or of a directory for an image sequence")
+    parser.add_argument("--races", type=int, default=3, help="number of races")
+    parser.add_argument("--size", type=int, nargs=2, default=(480, 360), metavar=("WIDTH", "HEIGHT"), help="size of the frames")
+    parser.add_argument("--version", type=int, default=0, help="index of the game region: " + ", ".join(VERSIONS))
+    parser.add_argument("--noise", type=int, default=6, help="maximum amplitude of the noise of the end of race screens")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random lap times, digits and noise")
+    parser.add_argument("--variety", action="store_true", help="draw each digit with a random picture of the dataset")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    run = SyntheticRun(args.races, tuple(args.size), args.version, args.noise, args.seed, args.variety)
+    write_run(run, args.output)
+    print(json.dumps(run.times))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
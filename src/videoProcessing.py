@@ -1,26 +1,307 @@
 import cv2
+import multiprocessing
 import numpy as np
-import pickle
-from pywinauto import application
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
+from digitAlignment import *
+from digitModel import *
+from frameSource import *
 from imageProcessing import *
-
-def in_range(n, a, b):
-    ''' Checks if number is n in ]a, b[ '''
-
-    if n > a and n < b:
-        return True
-    return False
+from resultCache import *
+from scanCheckpoint import *
+
+# Number of digits in an in game time screen
+DIGITS_PER_IGT = 15
+
+# Game regions, in the order of their indices
+VERSIONS = ("NTSC-U", "PAL", "NTSC-J")
+# Minimum margin between the best and the second best region
+# for the detected region to be trusted
+VERSION_MARGIN = 0.1
+
+# Size of the game after resizing the cropped video, to match pixel positions
+GAME_SIZE = (435, 323)
+
+# Coordinates of the end of race screen in the game, for each region
+NUMBER_ONE_COORD = (
+    (25, 35, 75, 85), # NTSC-U
+    (30, 40, 75, 85), # PAL
+    (25, 35, 75, 85), # NTSC-J
+)
+DIGIT_COORD = (
+    ((10, 24), (9, 23), (10, 24)), # First digit; NTSC-U, PAL, NTSC-J
+    ((35, 48), (32, 45), (30, 43)), # Second digit; NTSC-U, PAL, NTSC-J
+    ((50, 63), (44, 57), (43, 56)), # Third digit; NTSC-U, PAL, NTSC-J
+    ((74, 87), (65, 78), (64, 77)), # Fourth digit; NTSC-U, PAL, NTSC-J
+    ((89, 102), (76, 91), (77, 90)), # Fifth digit; NTSC-U, PAL, NTSC-J
+)
+ROW_COORD = (
+    (6, 28, 6, 28, 6, 28), # NTSC-U
+    (5, 26, 4, 25, -1, 20), # PAL
+    (6, 28, 6, 28, 6, 28), # NTSC-J
+)
+X_BUTTON_COORD = (
+    (290, 300, 170, 180), # NTSC-U
+    (280, 290, 170, 180), # PAL
+    (290, 300, 170, 180), # NTSC-J
+)
+IGT_COORD = (
+    (10, 103, 288, 420), # NTSC-U
+    (10, 93, 288, 407), # PAL
+    (10, 103, 288, 420), # NTSC-J
+)
+
+# Colors checked in the end of race screen: coordinates of the area for each
+# region and the range of the mean "h" (color) of the area in HSV
+COLOR_PROBES = (
+    (X_BUTTON_COORD, 150, 200), # Blue X button
+    (NUMBER_ONE_COORD, 25, 55), # Yellow top of the "1" number
+)
+
+# Time set to ignore impossible frames between races, loads and hub movement
+TIMEOUT = 2100
+# Number of frames checked for an in game time screen after a white flash.
+# If nothing is found, the next ten seconds are checked, since some
+# people may wait in the end without mashing X
+FLASH_WINDOW = 10
+IDLE_WINDOW = 300
+# Frames scanned before the start of each chunk of a parallel scan, besides the
+# timeout, so the timeout of a race found before the chunk is respected by its worker
+CHUNK_OVERLAP = FLASH_WINDOW + IDLE_WINDOW
+# Frames between two samples of the coarse to fine search, 1 checks every frame.
+# The white flash is shorter than that, so the search relies on the end of
+# race screen, which stays on screen for a few seconds
+SAMPLE_STRIDE = 8
+
+# Run categories, in the order of their indices, with their number of races.
+# Custom runs have an unknown number of races, so the whole video is scanned
+# unless the number is given.
+CATEGORY_TABLE = (
+    {"name": "Any% Warpless", "races": 21},
+    {"name": "All Cups", "races": 16},
+    {"name": "Single Cup", "races": 4},
+    {"name": "Custom", "races": None},
+)
+# Settings shared by every category, unless a run overrides them: frames ignored
+# after each race, which is also the minimum spacing between two races, and
+# maximum spacing in frames between two races after which the run is considered
+# over, None to scan until the end of the video
+CATEGORY_DEFAULTS = {"timeout": TIMEOUT, "max_spacing": None}
+CATEGORIES = tuple(category["name"] for category in CATEGORY_TABLE)
+
+# The screen flashes white at the end of every race, so the
+# corners of the screen get brighter than this threshold
+FLASH_SIZE = 50
+FLASH_THRESHOLD = 200
+# The white flash probe on the original video runs with a lower threshold,
+# since resizing the video blurs the corners a bit
+FLASH_PROBE_MARGIN = 20
 
 def mean_hsv(v):
     ''' Calculates the mean color of a HSV picture.
         @param v: cv2 HSV picture. '''
 
-    mean = 0
-    for i in range(len(v)):
-        for j in range(len(v[i])):
-            mean += v[i][j][0]
-    return mean / (len(v) * len(v[0]))
+    return np.mean(v[:, :, 0])
+
+
+def color_probe(version, probes=COLOR_PROBES):
+    ''' Precomputes the pixels read by the color probes of a region, so every probe
+        is measured at once. Returns the rows and columns of the pixels, a matrix
+        telling which probe each pixel belongs to, the number of pixels of each probe
+        and the ranges of the mean hues.
+        @param version: index of the game region.
+        @param probes: color probes, like COLOR_PROBES. '''
+
+    rows = []
+    columns = []
+    for (coords, _, _) in probes:
+        y1, y2, x1, x2 = coords[version]
+        probe_rows, probe_columns = np.mgrid[y1:y2, x1:x2]
+        rows.append(probe_rows.ravel())
+        columns.append(probe_columns.ravel())
+
+    sizes = np.array([len(probe_rows) for probe_rows in rows])
+    membership = np.zeros((sizes.sum(), len(probes)))
+    membership[np.arange(sizes.sum()), np.repeat(np.arange(len(probes)), sizes)] = 1
+    low = np.array([probe[1] for probe in probes])
+    high = np.array([probe[2] for probe in probes])
+
+    return np.concatenate(rows), np.concatenate(columns), membership, sizes, low, high
+
+
+def probe_colors(frames, probe):
+    ''' Calculates the mean hue of every color probe with a single color conversion.
+        @param frames: BGR frame resized to the game size, or a stack of them.
+        @param probe: return of color_probe(). '''
+
+    rows, columns, membership, sizes, _, _ = probe
+    pixels = frames[..., rows, columns, :]
+    hsv = cv2.cvtColor(pixels.reshape(-1, 1, 3), cv2.COLOR_BGR2HSV_FULL)
+    hue = hsv[:, 0, 0].reshape(pixels.shape[:-1])
+
+    return hue @ membership / sizes
+
+
+def matches_colors(frames, probe):
+    ''' Checks if the mean hue of every color probe is inside its range.
+        @param frames: BGR frame resized to the game size, or a stack of them.
+        @param probe: return of color_probe(). '''
+
+    means = probe_colors(frames, probe)
+    low, high = probe[4], probe[5]
+
+    return np.all((means > low) & (means < high), axis=-1)
+
+
+def category_settings(category):
+    ''' Gets the settings of a run category.
+        @param category: index of the category in CATEGORY_TABLE, or a dictionary
+        of custom settings. Settings missing in the dictionary are taken from the
+        category with the same name, or from the Custom category, and then from
+        CATEGORY_DEFAULTS. '''
+
+    if isinstance(category, dict):
+        name = category.get("name", CATEGORIES[-1])
+        base = CATEGORY_TABLE[CATEGORIES.index(name)] if name in CATEGORIES else CATEGORY_TABLE[-1]
+        settings = dict(CATEGORY_DEFAULTS, **base)
+        settings.update(category)
+        return settings
+
+    return dict(CATEGORY_DEFAULTS, **CATEGORY_TABLE[category])
+
+
+def category_key(settings):
+    ''' Identifies the settings of a category that change the races found.
+        @param settings: return of category_settings(). '''
+
+    return "%s,%s,%s" % (settings["races"], settings["timeout"], settings["max_spacing"])
+
+
+def calculate_total(times):
+    ''' Sums every lap time of the speedrun.
+        Returns the total in game time in hours, minutes, seconds and miliseconds.
+        @param times: every digit of each lap time of the speedrun. '''
+
+    # Variables to store the total time in h:min:s.ms
+    hours = 0
+    minutes = 0
+    seconds = 0
+    miliseconds = 0
+
+    # Looping each lap in each course
+    for lap_times in times:
+        # Since there are three laps by course, sum one lap at a time
+        for i in range(3):
+            miliseconds += lap_times[4 + i * 5] + (10 * lap_times[3 + i * 5])
+            if miliseconds > 99:
+                seconds += (miliseconds // 100)
+                miliseconds = miliseconds % 100
+            seconds += lap_times[2 + i * 5] + (10 * lap_times[1 + i * 5])
+            if seconds > 59:
+                minutes += (seconds // 60)
+                seconds = seconds % 60
+            minutes += lap_times[0 + i * 5]
+            if minutes > 59:
+                hours += (minutes // 60)
+                minutes = minutes % 60
+
+    return hours, minutes, seconds, miliseconds
+
+
+def predict_digits(model, digits, observer=None):
+    ''' Predicts a batch of processed digits in a single model call.
+        Returns the predicted numbers and the distances to the nearest neighbors
+        of each digit, which can be used as a confidence score.
+        @param model: compact DigitModel or trained KNeighborsClassifier.
+        @param digits: list of processed CTR digits.
+        @param observer: function called with the time of the model call. '''
+
+    features = np.reshape(digits, (len(digits), -1))
+    if observer is None:
+        neighbor_distances, neighbors = model.kneighbors(features)
+    else:
+        start = perf_counter()
+        neighbor_distances, neighbors = model.kneighbors(features)
+        observer("model_seconds", perf_counter() - start)
+        observer("digits_predicted", len(digits))
+
+    # Majority vote of the labels of the neighbors, which train.py stores
+    # in the classifier. Classifiers pickled without them predict on their own
+    if isinstance(model, DigitModel):
+        labels = model.labels
+    else:
+        labels = getattr(model, "training_labels", None)
+    if labels is None:
+        predictions = model.predict(features)
+    else:
+        predictions = vote(np.asarray(labels)[neighbors])
+
+    return predictions.tolist(), neighbor_distances
+
+
+def flash_corners(h1, h2, w1, w2):
+    ''' Maps the corners checked for the white flash from the game to the video,
+        rounding outwards so the corners in the video cover the ones in the game.
+        @param h1, h2, w1, w2: crop of the game in the video. '''
+
+    corner_height = -(-FLASH_SIZE * (h2 - h1) // GAME_SIZE[1])
+    corner_width = -(-FLASH_SIZE * (w2 - w1) // GAME_SIZE[0])
+
+    return (
+        (h1, h1 + corner_height, w1, w1 + corner_width),
+        (h2 - corner_height, h2, w2 - corner_width, w2),
+    )
+
+
+def probe_flash(original_frame, corners):
+    ''' Cheap test that discards frames without a white flash, reading only
+        the corners of the original video frame.
+        @param original_frame: frame of the video, before cropping.
+        @param corners: return of flash_corners(). '''
+
+    for (y1, y2, x1, x2) in corners:
+        # Mean of the grayscale corner, from the mean of each channel so no picture is allocated
+        blue, green, red, _ = cv2.mean(original_frame[y1:y2, x1:x2])
+        if 0.114 * blue + 0.587 * green + 0.299 * red <= FLASH_THRESHOLD - FLASH_PROBE_MARGIN:
+            return False
+
+    return True
+
+
+def is_flash(frame):
+    ''' Checks if the screen flashed white.
+        @param frame: grayscale frame, resized to the game size. '''
+
+    height, width = frame.shape
+    return np.mean(frame[0:FLASH_SIZE, 0:FLASH_SIZE]) > FLASH_THRESHOLD and np.mean(frame[height - FLASH_SIZE : height, width - FLASH_SIZE : width]) > FLASH_THRESHOLD
+
+
+def frame_buffers():
+    ''' Allocates the resized frame and the grayscale copy written by
+        transform_frame(), so a scan reuses them for every frame. '''
+
+    return np.empty((GAME_SIZE[1], GAME_SIZE[0], 3), np.uint8), np.empty((GAME_SIZE[1], GAME_SIZE[0]), np.uint8)
+
+
+def transform_frame(original_frame, h1, h2, w1, w2, buffers=None):
+    ''' Crops the game from a video frame and resizes it to match pixel positions.
+        Returns the resized frame and a grayscale copy.
+        @param original_frame: frame of the video.
+        @param h1, h2, w1, w2: crop of the game in the video.
+        @param buffers: return of frame_buffers(), overwritten by the frames
+        returned. None allocates new frames. '''
+
+    color, gray = (None, None) if buffers is None else buffers
+    original_frame = original_frame[h1:h2, w1:w2]
+    # Resize to match pixel positions, unless the source decoded the game at its size
+    if original_frame.shape[:2] != (GAME_SIZE[1], GAME_SIZE[0]):
+        original_frame = cv2.resize(original_frame, GAME_SIZE, dst=color)
+    # The grayscale copy comes from the resized frame, which has fewer pixels
+    frame = cv2.cvtColor(original_frame, cv2.COLOR_BGR2GRAY, dst=gray)
+
+    return original_frame, frame
+
 
 def load_video(file_path):
     ''' Opens a video using OpenCV2 library.
@@ -57,7 +338,9 @@ def crop_video(file_path):
     # To achieve the same result, there's a hacky way using pywinauto
     # If I create a blank window, I can search for its name and focus it
 
-    # Setting this blank window on focus
+    # Setting this blank window on focus. pywinauto is only
+    # imported here, since it only exists on Windows
+    from pywinauto import application
     app = application.Application()
     cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
     app.connect(title_re=window_name)
@@ -117,302 +400,871 @@ def crop_video(file_path):
 
     return h1, h2, w1, w2
 
-def process_video(file_path, h1, h2, w1, w2, version, category, stdscr):
+def scan_video(file_path, h1, h2, w1, w2, version, skip_mode=SKIP_GRAB, start=0, end=None, timeout=TIMEOUT, queue_depth=0, stats=None, observer=None, race_timeout=TIMEOUT, max_spacing=None, stride=1, ffmpeg=False):
+    ''' Searches the video for end of race screens, yielding the index of the frame
+        that flashed white, the index of the last frame checked after the flash and
+        the grayscale in game time picture of every race found.
+        @param file_path: path of the video file, or a frame source opened
+        by open_stream(), which is released once the scan is done.
+        @param h1, h2, w1, w2: crop of the game in the video.
+        @param version: index of the game region, None if it is unknown.
+        In that case the in game time pictures cover every region, see trim_igt(),
+        until the region is sent to the generator. Sending it switches the scan to
+        the colors and the in game time of the region, and returns True.
+        @param skip_mode: how the frames of the timeout after each race are skipped.
+        @param start: index of the first frame scanned.
+        @param end: index of the frame where the search for white flashes stops.
+        @param timeout: number of frames ignored at the start of the scan.
+        @param queue_depth: number of frames decoded ahead in a separate thread,
+        0 decodes in the same thread.
+        @param stats: dictionary that receives the starved and blocked counters
+        of the decoding queue once the scan is done.
+        @param observer: function called with the name and the value of each event
+        of the scan, see instrumentation.py. The counters of the frames are only
+        reported once the scan is done. None disables the events.
+        @param race_timeout: number of frames ignored after each race.
+        @param max_spacing: number of frames without a race after which
+        the scan stops, None to scan until the end.
+        @param stride: number of frames between the samples of the coarse to fine
+        search, 1 to check every frame. Sources that can't seek back, like the
+        decoding queue, check every frame.
+        @param ffmpeg: set to True to decode the video with ffmpeg straight to the
+        game size, see FFmpegReader. Falls back to OpenCV if ffmpeg isn't installed. '''
 
-    # Constants
-    NUMBER_ONE_COORD = (
-        (25, 35, 75, 85), # NTSC-U
-        (30, 40, 75, 85), # PAL
-        (25, 35, 75, 85), # NTSC-J
-    )
-    DIGIT_COORD = (
-        ((10, 24), (9, 23), (10, 24)), # First digit; NTSC-U, PAL, NTSC-J
-        ((35, 48), (32, 45), (30, 43)), # Second digit; NTSC-U, PAL, NTSC-J
-        ((50, 63), (44, 57), (43, 56)), # Third digit; NTSC-U, PAL, NTSC-J
-        ((74, 87), (65, 78), (64, 77)), # Fourth digit; NTSC-U, PAL, NTSC-J
-        ((89, 102), (76, 91), (77, 90)), # Fifth digit; NTSC-U, PAL, NTSC-J
-    )
-    ROW_COORD = (
-        (6, 28, 6, 28, 6, 28), # NTSC-U
-        (5, 26, 4, 25, -1, 20), # PAL
-        (6, 28, 6, 28, 6, 28), # NTSC-J
-    )
-    GAME_SIZE = (435, 323)
-    X_BUTTON_COORD = (
-        (290, 300, 170, 180), # NTSC-U
-        (280, 290, 170, 180), # PAL
-        (290, 300, 170, 180), # NTSC-J
-    )
-    IGT_COORD = (
-        (10, 103, 288, 420), # NTSC-U
-        (10, 93, 288, 407), # PAL
-        (10, 103, 288, 420), # NTSC-J
+    # Load video
+    video = None
+    if not isinstance(file_path, str):
+        video = file_path
+    elif ffmpeg:
+        video = open_ffmpeg(file_path, (h1, h2, w1, w2), GAME_SIZE, skip_mode)
+        # The frames are already cropped and resized
+        if video is not None:
+            h1, h2, w1, w2 = 0, GAME_SIZE[1], 0, GAME_SIZE[0]
+    if video is None:
+        video = open_video(file_path, skip_mode, queue_depth)
+    status = video.skip(start)
+    if status:
+        status, original_frame = video.read()
+    # Index of the frame in original_frame
+    index = start
+    # Coarse to fine search: outside the timeouts, only one frame every stride frames
+    # is checked. When a sample looks like a white flash or an end of race screen,
+    # the video seeks back and the frames before the sample are checked one by one
+    sparse = stride > 1 and hasattr(video, "seek")
+    # Frames before dense_until are checked one by one. The rescans never go back
+    # before checked, the first frame sampled since the last frames checked one by one
+    dense_until = index
+    checked = index
+    sampled = False
+    # Longer rescan done if the one right before the sample found no flash,
+    # and frame where the sampling resumes after the rescans
+    deep = None
+    resume = None
+    # Every frame is resized into the same buffers
+    buffers = frame_buffers()
+    # Corners of the video checked before transforming each frame
+    corners = flash_corners(h1, h2, w1, w2)
+    # Pixels checked for the colors of the end of race screen. If the region
+    # is unknown, any region can match and the in game time of every region is cropped
+    versions = range(len(VERSIONS)) if version is None else [version]
+    probes = [color_probe(probe_version) for probe_version in versions]
+    igt_coord = igt_union() if version is None else IGT_COORD[version]
+    in_game_time = None
+    # Darkest in game time picture found after the current flash. Only the best
+    # candidate is kept, in a buffer reused by every race
+    best = np.empty((igt_coord[1] - igt_coord[0], igt_coord[3] - igt_coord[2]), np.uint8)
+    # Index of the last frame checked after the previous race
+    last_race = start
+    # Counters reported to the observer, the first frame was decoded above
+    decoded = 1
+    grabbed = 0
+    skipped = 0
+    samples = 0
+    rescans = 0
+    flash_candidates = 0
+    flashes = 0
+    probe_hits = 0
+    probe_misses = 0
+
+    try:
+        while status and (end is None or index < end):
+
+            # The run is over if no race was found for too long
+            if max_spacing is not None and index - last_race > max_spacing:
+                break
+
+            # If you're in a timeout, ignore the frames
+            if timeout > 0:
+                # Skip every frame but the last one of the timeout
+                status = video.skip(timeout - 1)
+                index += timeout
+                skipped += timeout - 1
+                timeout = 0
+                sampled = False
+                if status:
+                    status, original_frame = video.read()
+                    decoded += 1
+                # The last frame of the timeout will be checked in the next iteration
+                continue
+
+            if sparse and index >= dense_until:
+
+                # The rescan right before the sample found no flash, but the runner may
+                # have waited on the end of race screen, so the frames before that rescan
+                # are checked too. Then the sampling resumes after the sample
+                if deep is not None or (resume is not None and resume > index):
+                    if deep is not None:
+                        resume = index
+                        index, dense_until = deep
+                        deep = None
+                    else:
+                        index, resume = resume, None
+                    status = video.seek(index)
+                    if status:
+                        status, original_frame = video.read()
+                        decoded += 1
+                    continue
+                resume = None
+
+                if not sampled:
+                    checked = index
+                    sampled = True
+                samples += 1
+
+                # Same cheap test of the corners as below, then the colors of the end of race screen
+                flash = probe_flash(original_frame, corners)
+                if flash:
+                    flash = is_flash(transform_frame(original_frame, h1, h2, w1, w2, buffers)[1])
+                results = False
+                if not flash:
+                    game = transform_frame(original_frame, h1, h2, w1, w2, buffers)[0]
+                    results = any(matches_colors(game, probe) for probe in probes)
+
+                if flash or results:
+                    rescans += 1
+                    # The flash happened after the previous sample, a few frames before
+                    # the end of race screen, unless the runner waited before mashing X
+                    near = max(checked, index - stride + 1 - (0 if flash else FLASH_WINDOW))
+                    far = max(checked, near - IDLE_WINDOW)
+                    deep = (far, near) if results and far < near else None
+                    dense_until = index + 1
+                    index = near
+                    status = video.seek(index)
+                    if status:
+                        status, original_frame = video.read()
+                        decoded += 1
+                    continue
+
+                # Next sample, without passing the last frame of the chunk or of the run
+                step = stride
+                if end is not None:
+                    step = min(step, end - 1 - index)
+                if max_spacing is not None:
+                    step = min(step, last_race + max_spacing - index)
+                step = max(1, step)
+                status = video.skip(step - 1)
+                # The frames between the samples are only spared the conversion to pictures
+                if skip_decodes(video, step - 1):
+                    decoded += step - 1
+                    grabbed += step - 1
+                index += step
+                if status:
+                    status, original_frame = video.read()
+                    decoded += 1
+                continue
+
+            # Most frames don't have a white flash, so they are discarded
+            # before transforming them. Those left are cropped and resized.
+            flash = probe_flash(original_frame, corners)
+            if flash:
+                flash_candidates += 1
+                original_frame, frame = transform_frame(original_frame, h1, h2, w1, w2, buffers)
+                flash = is_flash(frame)
+
+            # If the screen flashed white, the next frames may contain an in game time screen
+            if flash:
+                flash_index = index
+                flashes += 1
+
+                # Number of possible in game time images, and mean of the best one
+                candidates = 0
+                minimum = 160
+
+                has_checked = False
+                frame_window = FLASH_WINDOW
+                # Check the next frames in the frame_window
+                while True:
+
+                    # If the average color of the x button is blue enough AND
+                    # the average color of the top of the "1" is yellow enough
+                    if any(matches_colors(original_frame, probe) for probe in probes):
+
+                        # You found a finish level screen. Keep the IGT crop
+                        # if it is the "darkest" one, ignoring too dark pictures
+                        candidate = frame[igt_coord[0] : igt_coord[1], igt_coord[2] : igt_coord[3]]
+                        mean = candidate.mean()
+                        if mean < minimum and mean > 70:
+                            minimum = mean
+                            np.copyto(best, candidate)
+                        candidates += 1
+                        probe_hits += 1
+                    else:
+                        probe_misses += 1
+
+                    status, original_frame = video.read()
+                    decoded += 1
+                    # Checking end of video
+                    if status == False:
+                        break
+                    index += 1
+
+                    # Read new frame, crop and make a grayscale copy
+                    original_frame, frame = transform_frame(original_frame, h1, h2, w1, w2, buffers)
+
+                    frame_window -= 1
+                    # If you've checked every frame
+                    if frame_window == 0:
+
+                        # If you already checked the next ten seconds, you're done in this loop
+                        if has_checked:
+                            break
+
+                        # If you found an IGT match, you're done in this loop
+                        if candidates > 0:
+                            break
+
+                        # If you didn't, check the next ten seconds,
+                        # since some people may wait in the end without mashing X
+                        frame_window = IDLE_WINDOW
+                        has_checked = True
+
+                if observer is not None:
+                    observer("igt_candidates", candidates)
+
+                # If you found any possible IGT match
+                if candidates > 0:
+
+                    # The race gets its own copy of the darkest IGT image. If every
+                    # candidate was too dark or too bright, the previous one is kept
+                    if minimum < 160:
+                        in_game_time = best.copy()
+
+                    # Set a timeout, you won't need to check end of race in the next 1:10
+                    timeout = race_timeout
+                    last_race = index
+                    # The race ends the rescans of the sample that led to it
+                    deep = None
+                    resume = None
+                    region = yield flash_index, index, in_game_time
+
+                    # The region was detected, so the next races only need its colors and in game time
+                    if region is not None:
+                        version = region
+                        probes = [color_probe(version)]
+                        igt_coord = IGT_COORD[version]
+                        best = np.empty((igt_coord[1] - igt_coord[0], igt_coord[3] - igt_coord[2]), np.uint8)
+                        if in_game_time is not None and in_game_time.shape != best.shape:
+                            in_game_time = trim_igt(in_game_time, version)
+                        # Returned by send(), the next race is yielded to the next call
+                        yield True
+
+            # Read new frame and check the status of the video
+            status, original_frame = video.read()
+            decoded += 1
+            index += 1
+            sampled = False
+
+    finally:
+        video.release()
+        # Expose the counters of the decoding queue
+        if stats is not None and isinstance(video, ThreadedVideoReader):
+            stats["starved"] = stats.get("starved", 0) + video.starved
+            stats["blocked"] = stats.get("blocked", 0) + video.blocked
+        if observer is not None:
+            observer("frames_decoded", decoded)
+            observer("frames_grabbed", grabbed)
+            observer("frames_skipped", skipped)
+            observer("samples", samples)
+            observer("rescans", rescans)
+            observer("flash_candidates", flash_candidates)
+            observer("flashes", flashes)
+            observer("probe_hits", probe_hits)
+            observer("probe_misses", probe_misses)
+
+
+def skip_decodes(video, count):
+    ''' Checks if skipping frames of a source still decodes them, like grabbing
+        frames with OpenCV or reading them from the pipe of ffmpeg. Image sequences
+        and long skips of seeking sources don't decode the skipped frames.
+        @param video: frame source.
+        @param count: number of frames skipped. '''
+
+    if isinstance(video, ImageSequenceReader):
+        return False
+
+    return not (getattr(video, "skip_mode", SKIP_GRAB) == SKIP_SEEK and count >= SEEK_MIN_FRAMES)
+
+
+def scan_chunk(chunk):
+    ''' Scans a chunk of the video in a worker process, returning the end of race
+        screens that flashed white inside the chunk.
+        @param chunk: tuple with the file path, the crop of the game, the region,
+        the skip mode, the first, the first owned and the last frames of the chunk,
+        the timeout at its first frame, the depth of the decoding queue, whether
+        the events of the scan are recorded, the timeout after each race, the
+        stride of the coarse to fine search and whether ffmpeg decodes the video.
+        Returns the races and the events. '''
+
+    file_path, h1, h2, w1, w2, version, skip_mode, start, owned, end, timeout, queue_depth, observed, race_timeout, stride, ffmpeg = chunk
+
+    # The observer lives in the main process, so the events are recorded and sent back
+    events = []
+    observer = (lambda event, value: events.append((event, value))) if observed else None
+    races = scan_video(file_path, h1, h2, w1, w2, version, skip_mode, start, end, timeout, queue_depth, observer=observer, race_timeout=race_timeout, stride=stride, ffmpeg=ffmpeg)
+
+    return [race for race in races if race[0] >= owned], events
+
+
+def scan_video_parallel(file_path, h1, h2, w1, w2, version, skip_mode=SKIP_GRAB, workers=1, queue_depth=0, stats=None, start=0, observer=None, race_timeout=TIMEOUT, max_spacing=None, stride=1, ffmpeg=False):
+    ''' Splits the video in chunks scanned by a pool of processes, yielding
+        the same values as scan_video. Races found too close to the previous one,
+        which a sequential scan would have ignored, are discarded. The chunks scanned
+        in parallel can't switch to a region sent to the generator, so sending it returns False.
+        @param file_path: path of the video file.
+        @param h1, h2, w1, w2: crop of the game in the video.
+        @param version: index of the game region.
+        @param skip_mode: how the frames of the timeout after each race are skipped.
+        Chunks can only start at their own frames with SKIP_SEEK, so the other
+        modes scan the video sequentially.
+        @param workers: number of processes scanning the video.
+        @param queue_depth: number of frames decoded ahead in a separate thread.
+        @param stats: dictionary that receives the counters of the decoding queue
+        of a sequential scan.
+        @param start: index of the first frame scanned, which starts a timeout
+        like the start of the video or the frame after a race.
+        @param observer: function called with the events of the scan. The events
+        of each chunk are reported once the chunk is done.
+        @param race_timeout: number of frames ignored after each race.
+        @param max_spacing: number of frames without a race after which
+        the scan stops, None to scan until the end.
+        @param stride: number of frames between the samples of the coarse to fine
+        search, 1 to check every frame.
+        @param ffmpeg: set to True to decode the video with ffmpeg, if it is installed. '''
+
+    frame_count = count_frames(file_path)
+
+    # Without the number of frames, the video can't be split. Without seeking, each chunk
+    # would grab every frame before its start, decoding about workers / 2 times the video
+    if workers <= 1 or frame_count <= start or skip_mode != SKIP_SEEK:
+        yield from scan_video(file_path, h1, h2, w1, w2, version, skip_mode, start, timeout=race_timeout, queue_depth=queue_depth, stats=stats, observer=observer, race_timeout=race_timeout, max_spacing=max_spacing, stride=stride, ffmpeg=ffmpeg)
+        return
+
+    chunk_size = -(-(frame_count - start) // workers)
+    chunks = []
+    for owned in range(start, frame_count, chunk_size):
+        # The last chunk scans until the video ends, in case the number of frames is inaccurate
+        end = owned + chunk_size if owned + chunk_size < frame_count else None
+        # The first chunk starts with the same timeout as a sequential scan, the others
+        # start scanning before their own frames to catch up with the races of the previous chunk
+        if owned == start:
+            chunks.append((file_path, h1, h2, w1, w2, version, skip_mode, start, owned, end, race_timeout, queue_depth, observer is not None, race_timeout, stride, ffmpeg))
+        else:
+            overlap = race_timeout + CHUNK_OVERLAP
+            chunks.append((file_path, h1, h2, w1, w2, version, skip_mode, max(start, owned - overlap), owned, end, 0, queue_depth, observer is not None, race_timeout, stride, ffmpeg))
+
+    # Index of the last frame checked after the previous race
+    last_index = None
+    with multiprocessing.Pool(workers) as pool:
+        # Chunks are merged in order, as soon as they are done
+        for races, events in pool.imap(scan_chunk, chunks):
+            if observer is not None:
+                for event, value in events:
+                    observer(event, value)
+            for flash_index, index, in_game_time in races:
+                # A sequential scan would still be in the timeout of the previous race
+                if last_index is not None and flash_index <= last_index + race_timeout:
+                    continue
+                # A sequential scan would have stopped before this race, since the run was over
+                if max_spacing is not None and flash_index - (start if last_index is None else last_index) > max_spacing:
+                    return
+                last_index = index
+                region = yield flash_index, index, in_game_time
+                # The chunks already cropped the in game time of every region
+                if region is not None:
+                    yield False
+
+
+def igt_union():
+    ''' Coordinates of the smallest area containing the in game time of every region. '''
+
+    return (
+        min(coord[0] for coord in IGT_COORD),
+        max(coord[1] for coord in IGT_COORD),
+        min(coord[2] for coord in IGT_COORD),
+        max(coord[3] for coord in IGT_COORD),
     )
-    HEIGHT_FIX = 0
-    WIDTH_FIX = 0
 
-    # Load video
-    video, original_frame, frame, height, width = load_video(file_path)
-    # Saving cropped frame
-    original_frame = original_frame[h1:h2, w1:w2]
-    # Saving cropped grayscale copy
-    frame = frame[h1:h2, w1:w2]
-    # Resize to match pixel positions
-    original_frame = cv2.resize(original_frame, GAME_SIZE)
-    frame = cv2.resize(frame, GAME_SIZE)
-    # Update height and width
-    height, width = frame.shape
+
+def trim_igt(in_game_time, version):
+    ''' Crops the in game time of a region from a picture covering every region.
+        @param in_game_time: grayscale in game time picture, cropped with igt_union().
+        @param version: index of the game region. '''
+
+    y1, y2, x1, x2 = IGT_COORD[version]
+    union = igt_union()
+
+    return in_game_time[y1 - union[0] : y2 - union[0], x1 - union[2] : x2 - union[2]]
+
+
+def detect_version(in_game_time, model):
+    ''' Detects the region of the game by reading the in game time screen with the
+        coordinates of every region. The region whose digits are closest to the
+        model wins. Returns the region, the margin to the second best region,
+        relative to its distance, and the score of every region.
+        @param in_game_time: grayscale in game time picture, cropped with igt_union().
+        @param model: digits model. '''
+
+    scores = []
+    for version in range(len(VERSIONS)):
+        try:
+            trimmed = trim_igt(in_game_time, version)
+            race_digits = read_race(trimmed, version, race_alignment(trimmed, version, []))
+            _, neighbor_distances = predict_digits(model, race_digits)
+            scores.append(race_confidence(neighbor_distances))
+        # The coordinates of the wrong region may crop digits that can't be processed
+        except (cv2.error, ZeroDivisionError, ValueError):
+            scores.append(float("inf"))
+
+    order = np.argsort(scores)
+    best, second = scores[order[0]], scores[order[1]]
+    margin = (second - best) / second if 0 < second < float("inf") else float(second > best)
+
+    return int(order[0]), margin, scores
+
+
+def row_coord(version, row, height_fix=0):
+    ''' Vertical coordinates of a row of the in game time picture.
+        @param version: index of the game region.
+        @param row: index of the row.
+        @param height_fix: vertical alignment of the row. '''
+
+    return 26 * row + height_fix + ROW_COORD[version][2 * row], 26 * row + height_fix + ROW_COORD[version][2 * row + 1]
+
+
+def first_digits(in_game_time, version, width_fix):
+    ''' Crops and processes the first digit of each row, before aligning the rows.
+        @param in_game_time: grayscale in game time picture.
+        @param version: index of the game region.
+        @param width_fix: horizontal alignment of the digits. '''
+
+    digits = []
+    for i in range(3):
+        y1, y2 = row_coord(version, i)
+        digit = in_game_time[y1:y2, width_fix + DIGIT_COORD[0][version][0] : width_fix + DIGIT_COORD[0][version][1]]
+        digits.append(process_digit(cv2.resize(digit, DIGIT_SIZE)))
+
+    return digits
+
+
+def measure_alignment(in_game_time, version):
+    ''' Measures the horizontal alignment of the digits of a race on the first digit
+        of each row, which fixes small misalignments of different capture card outputs.
+        Returns the offsets that could be measured, in the order of the rows.
+        @param in_game_time: grayscale in game time picture.
+        @param version: index of the game region. '''
+
+    offsets, valid = column_offsets(first_digits(in_game_time, version, 0))
+
+    return offsets[valid].tolist()
+
+
+def race_alignment(in_game_time, version, estimates):
+    ''' Horizontal alignment used to read a race: the running estimate of the video,
+        or the offset measured on the first digit of the race if no race was read yet.
+        The measure is only trusted on the first race, since a lap of a minute
+        or more starts with a 1, which breaks it.
+        @param in_game_time: grayscale in game time picture.
+        @param version: index of the game region.
+        @param estimates: alignment of every race read so far, see running_offset(). '''
+
+    if len(estimates) > 0:
+        return running_offset(estimates)
+    measured = measure_alignment(in_game_time, version)
+
+    return measured[0] if len(measured) > 0 else 0
+
+
+def read_race(in_game_time, version, width_fix, observer=None):
+    ''' Crops and processes the digits of an in game time screen, aligning each row
+        vertically with its first digit. Returns the processed digits.
+        @param in_game_time: grayscale in game time picture.
+        @param version: index of the game region.
+        @param width_fix: horizontal alignment of the digits, see measure_alignment().
+        @param observer: function called with the time of processing each digit. '''
+
+    # The height of every row is aligned at once, from its first digit
+    height_fixes = row_offsets(first_digits(in_game_time, version, width_fix))
+    rows = []
+    for i in range(3):
+        y1, y2 = row_coord(version, i, int(height_fixes[i]))
+        rows.append(in_game_time[y1:y2, 0:])
+
+    # List to store each processed digit of the race
+    race_digits = []
+    for i in range(3):
+        for j in range(5):
+            digit = rows[i][0:, width_fix + DIGIT_COORD[j][version][0] : width_fix + DIGIT_COORD[j][version][1]]
+            # Resizing each digit to make them bigger,
+            # and also make sure that they will have the same size for the KNN input.
+            digit = cv2.resize(digit, DIGIT_SIZE_HIGH)
+            # Process the digit before predicting
+            if observer is None:
+                race_digits.append(process_digit(digit))
+            else:
+                start = perf_counter()
+                race_digits.append(process_digit(digit))
+                observer("digit_seconds", perf_counter() - start)
+
+    return race_digits
+
+
+def recognize_race(model, in_game_time, version, width_fix, defer_prediction, realign=False, observer=None):
+    ''' Reads a race, in the scan thread or in a thread of the recognition pool.
+        Returns the processed digits if the predictions are deferred, otherwise
+        the predicted digits and their distances, along with the alignment
+        the race was read with.
+        @param model: return of load_model().
+        @param in_game_time: grayscale in game time picture.
+        @param version: index of the game region.
+        @param width_fix: horizontal alignment of the digits, see running_offset().
+        @param defer_prediction: set to True to only process the digits.
+        @param realign: set to True to read the race again with the alignments measured
+        on its own digits if they are far from the model, keeping the closest reading.
+        Ignored if the predictions are deferred.
+        @param observer: function called with the time of each digit and model call. '''
+
+    race_digits = read_race(in_game_time, version, width_fix, observer)
+    if defer_prediction:
+        return race_digits, width_fix
+
+    best = predict_digits(model, race_digits, observer), width_fix
+    if realign and race_confidence(best[0][1]) > REALIGN_DISTANCE:
+        if observer is not None:
+            observer("realigned", 1)
+        for own_fix in sorted(set(measure_alignment(in_game_time, version)) - {width_fix}):
+            reading = predict_digits(model, read_race(in_game_time, version, own_fix, observer), observer)
+            if race_confidence(reading[1]) < race_confidence(best[0][1]):
+                best = reading, own_fix
+
+    return best
+
+
+def collect_races(futures, times, distances, pending, estimates, defer_prediction, wait=False):
+    ''' Moves the races read by the recognition pool to the results, in the order
+        of the races. Stops at the first race still being read, unless waiting.
+        @param futures: futures of recognize_race(), in the order of the races.
+        @param times, distances: digits and distances of the races predicted.
+        @param pending: processed digits of the races waiting to be predicted.
+        @param estimates: alignment of every race read.
+        @param defer_prediction: whether the predictions are deferred.
+        @param wait: set to True to wait for every race. '''
+
+    while len(futures) > 0 and (wait or futures[0].done()):
+        store_race(futures.pop(0).result(), times, distances, pending, estimates, defer_prediction)
+
+
+def store_race(race, times, distances, pending, estimates, defer_prediction):
+    ''' Adds a race read by recognize_race() to the results, and its alignment
+        to the running estimate of the video.
+        @param race: return of recognize_race().
+        @param times, distances: digits and distances of the races predicted.
+        @param pending: processed digits of the races waiting to be predicted.
+        @param estimates: alignment of every race read.
+        @param defer_prediction: whether the predictions are deferred. '''
+
+    result, width_fix = race
+    estimates.append(width_fix)
+    if defer_prediction:
+        pending.append(result)
+    else:
+        times.append(result[0])
+        distances.append(result[1])
+
+
+def process_video(file_path, h1, h2, w1, w2, version, category, stdscr, defer_prediction=False, skip_mode=SKIP_SEEK, workers=1, queue_depth=0, stats=None, checkpoint=None, cache_dir=None, observer=None, stride=1, ffmpeg=False, recognition_threads=0, realign=False):
+    ''' Finds every in game time screen of the speedrun and predicts its digits.
+        Returns the digits of each race, the in game time pictures and the distances
+        of each digit to its nearest neighbors in the model.
+        @param file_path: path of the video file, or of a directory with an image sequence.
+        @param h1, h2, w1, w2: crop of the game in the video.
+        @param version: index of the game region, None to detect it on the first race.
+        @param category: index of the run category, or a dictionary of custom
+        settings, see category_settings(). The scan stops once every race is found.
+        @param stdscr: standart screen of curses, None to hide the progress.
+        @param defer_prediction: set to True to predict the digits of every race
+        in a single model call at the end of the video.
+        @param skip_mode: how the frames of the timeout after each race are skipped.
+        SKIP_SEEK falls back to SKIP_GRAB if seeking is inaccurate in the video.
+        @param workers: number of processes scanning the video. Videos where seeking
+        isn't accurate are scanned by a single process.
+        @param queue_depth: number of frames decoded ahead in a separate thread,
+        0 decodes in the same thread.
+        @param stats: dictionary that receives the detected region, its margin and
+        the counters of the decoding queue.
+        @param checkpoint: path of a checkpoint file, written after every race found.
+        If it holds a checkpoint of the same video and settings, the scan resumes
+        after its last race. None disables the checkpoints.
+        @param cache_dir: directory of the result cache. A video already processed
+        with the same crop, region and category returns its cached result
+        without scanning. None disables the cache.
+        @param observer: function called with the name and the value of each event
+        of the pipeline, see instrumentation.py. None disables the events.
+        @param stride: number of frames between the samples of the coarse to fine
+        search, 1 to check every frame. It needs accurate seeking and no decoding
+        queue, otherwise every frame is checked.
+        @param ffmpeg: set to True to decode the video with ffmpeg straight to the
+        game size. Falls back to OpenCV if ffmpeg isn't installed.
+        @param recognition_threads: number of threads reading the races while the
+        scan moves on to the next one, 0 reads each race before scanning again.
+        @param realign: set to True to read the races whose digits are far from the
+        model again, with the alignments measured on their own digits, which moves
+        the running estimate of the video if it was wrong. '''
+
+    settings = category_settings(category)
+
+    # Returning the result of a previous processing of the video
+    if cache_dir is not None:
+        result_key = cache_key(file_path, h1, h2, w1, w2, version, category_key(settings), ffmpeg, realign)
+        result = load_result(result_key, cache_dir)
+        if result is not None:
+            if stats is not None:
+                stats["cached"] = True
+                stats["frames"] = result["frames"]
+                if version is None:
+                    stats["version"] = result["version"]
+                    stats["version_margin"] = result["version_margin"]
+            return result["times"], result["igt"], result["distances"]
+
+    # Only seek if it lands on the right frames in this video. The coarse
+    # to fine search seeks back to its rescans, and the chunks of the workers
+    # seek to their start, so they need it too
+    if (skip_mode == SKIP_SEEK or stride > 1 or workers > 1) and not seek_is_accurate(file_path):
+        if skip_mode == SKIP_SEEK:
+            skip_mode = SKIP_GRAB
+        stride = 1
+        workers = 1
+
     # Load machine learning model to predict the CTR digits
-    model = pickle.load(open("CTR_digits.knn", 'rb'))
-    # Variable that adjusts the cropping in the first race
-    first_race = True
+    model = load_model()
+    # Horizontal alignment of every race read, combined in a running estimate
+    width_estimates = []
     # Variables to store the returning values
     igt = []
     times = []
+    distances = []
+    # Processed digits of each race waiting to be predicted
+    pending = []
+    # Flash and last checked frames of each race
+    frames = []
 
-    # Time set to ignore impossible frames between races, loads and hub movement
-    timeout = 2100
-    # Setting number of races of the speedrun
-    num_races = 0
-    if category == 0:
-        num_races = 21
-    elif category == 1:
-        num_races = 16
+    # Setting number of races of the speedrun, None if it isn't known
+    num_races = settings["races"]
 
     # Number of in game time screens found in the game
     igt_found = 0
+    # Frame where the scan starts, and margin of the detected region
+    start = 0
+    margin = 0.0
+    done = False
 
-    # While there are still in game time screens to be found
-    while igt_found < num_races:
-
-        # If you're in a timeout, ignore the frames
-        if timeout > 0:
-            status, original_frame = video.read()
-            timeout -= 1
-            # If the timeout is over
-            if timeout == 0:
-                # Apply transformations, since the last frame of the timeout
-                # will be checked in the next iteration
-                original_frame = original_frame[h1:h2, w1:w2]
-                frame = cv2.cvtColor(original_frame, cv2.COLOR_BGR2GRAY)
-                # Resize to match pixel positions
-                original_frame = cv2.resize(original_frame, GAME_SIZE)
-                frame = cv2.resize(frame, GAME_SIZE)
-            continue
-
-        # If the screen flashed white, the next frames may contain an in game time screen
-        if np.mean(frame[0:50, 0:50]) > 200 and np.mean(frame[height - 50 : height, width - 50 : width]) > 200:
-
-            # Store possible in game time images
-            cache = []
-
-            has_checked = False
-            frame_window = 10
-            # Check the next frames in the frame_window
-            while True:
-
-                # Crop the area of the blue X button
-                x_continue = original_frame[X_BUTTON_COORD[version][0] : X_BUTTON_COORD[version][1], X_BUTTON_COORD[version][2] : X_BUTTON_COORD[version][3]]
-                # Transform to HSV, so we can measure how blue the image is
-                x_continue_hsv = cv2.cvtColor(x_continue, cv2.COLOR_BGR2HSV_FULL)
-                # Calculate the mean value of the "h" (color)
-                x_mean = mean_hsv(x_continue_hsv)
-
-                # Crop the area of the top of the "1" number
-                number_one = original_frame[NUMBER_ONE_COORD[version][0]: NUMBER_ONE_COORD[version][1], NUMBER_ONE_COORD[version][2] : NUMBER_ONE_COORD[version][3]]
-                # Transform to HSV, so we can measure how yellow the image is
-                number_one_hsv = cv2.cvtColor(number_one, cv2.COLOR_BGR2HSV_FULL)
-                # Calculate the mean value of the "h" (color)
-                one_mean = mean_hsv(number_one_hsv)
-
-                # If the average color of the x button is blue enough AND
-                # the average color of the top of the "1" is yellow enough
-                if in_range(x_mean, 150, 200) and in_range(one_mean, 25, 55):
-
-                    # You found a finish level screen
-                    # Add the IGT crop to the cache
-                    cache.append(frame[IGT_COORD[version][0] : IGT_COORD[version][1], IGT_COORD[version][2] : IGT_COORD[version][3]])
-
-                status, original_frame = video.read()
-                # Checking end of video
-                if status == False:
-                    break
-
-                # Read new frame, crop and make a grayscale copy
-                original_frame = original_frame[h1:h2, w1:w2]
-                frame = cv2.cvtColor(original_frame, cv2.COLOR_BGR2GRAY)
-                # Resize to match pixel positions
-                original_frame = cv2.resize(original_frame, GAME_SIZE)
-                frame = cv2.resize(frame, GAME_SIZE)
-
-                frame_window -= 1
-                # If you've checked every frame
-                if frame_window == 0:
-
-                    # If you already checked the next ten seconds, you're done in this loop
-                    if has_checked:
-                        break
-
-                    # If you found an IGT match, you're done in this loop
-                    if len(cache) > 0:
-                        break
-
-                    # If you didn't, check the next ten seconds,
-                    # since some people may wait in the end without mashing X
-                    frame_window = 300
-                    has_checked = True
-
-            # If you found any possible IGT match
-            if (len(cache) > 0):
-
-                # Find the "darkest" IGT image
-                minimum = 160
-                for img in cache:
-                    if np.mean(img) < minimum and np.mean(img) > 70:
-                        minimum = np.mean(img)
-                        in_game_time = img
-
-                # Set a timeout, you won't need to check end of race in the next 1:10
-                timeout = 2100
-                # Increase the number of IGT screens found
-                igt_found += 1
-                # Update the progress to the user
-                stdscr.addstr(igt_found, 0, str(igt_found)+"/"+str(num_races)+" IGT screens found.")
+    # Resuming the scan from the last race of the checkpoint
+    if checkpoint is not None:
+        key = checkpoint_key(file_path, h1, h2, w1, w2, version, category_key(settings), defer_prediction, ffmpeg, realign)
+        state = load_checkpoint(checkpoint, key)
+        if state is not None:
+            start = state["index"]
+            igt_found = state["igt_found"]
+            width_estimates = state["width_estimates"]
+            done = state["done"]
+            igt = state["igt"]
+            times = state["times"]
+            distances = state["distances"]
+            pending = state["pending"]
+            frames = state["frames"]
+            # The region detected before the interruption
+            if version is None and state["version"] is not None:
+                version = state["version"]
+                margin = state["version_margin"]
+                if stats is not None:
+                    stats["version"] = version
+                    stats["version_margin"] = margin
+            # Races found before the interruption but still being read are read again
+            for in_game_time in igt[len(times) + len(pending):]:
+                race = recognize_race(model, in_game_time, version, race_alignment(in_game_time, version, width_estimates), defer_prediction, realign, observer)
+                store_race(race, times, distances, pending, width_estimates, defer_prediction)
+
+    # Races read by the recognition pool, in the order of the races
+    pool = ThreadPoolExecutor(recognition_threads) if recognition_threads > 0 else None
+    futures = []
+
+    # Searching the in game time screens until every race is found
+    detect = version is None
+    scan = scan_video_parallel(file_path, h1, h2, w1, w2, version, skip_mode, workers, queue_depth, stats, start, observer, settings["timeout"], settings["max_spacing"], stride, ffmpeg)
+    # Every race was found before the interruption
+    if done:
+        scan.close()
+    try:
+        for flash_index, index, in_game_time in scan:
+
+            # Lock the region that reads the first race best. The scan crops
+            # the next races with its coordinates, if it can switch to them
+            if detect:
+                if version is None:
+                    version, margin, _ = detect_version(in_game_time, model)
+                    if stats is not None:
+                        stats["version"] = version
+                        stats["version_margin"] = margin
+                    detect = not scan.send(version)
+                in_game_time = trim_igt(in_game_time, version)
+
+            # Increase the number of IGT screens found
+            igt_found += 1
+            # Update the progress to the user
+            if stdscr is not None:
+                stdscr.addstr(igt_found, 0, str(igt_found)+("" if num_races is None else "/"+str(num_races))+" IGT screens found.")
                 stdscr.refresh()
 
-                # Crop the rows from the IGT screen
-                rows = []
-                for i in range(3):
-                    # Variables to adjust the height of the rows
-                    HEIGHT_FIX = 0
-                    fixed_height = False
-
-                    while True:
-
-                        # Crop the row
-                        row = in_game_time[26 * i + HEIGHT_FIX + ROW_COORD[version][2 * i] : 26 * i + HEIGHT_FIX + ROW_COORD[version][2 * i + 1], 0:]
-                        # Crop the first digit of the row and process it
-                        digit = row[0:, WIDTH_FIX + DIGIT_COORD[0][version][0] : WIDTH_FIX + DIGIT_COORD[0][version][1]]
-                        digit = cv2.resize(digit, DIGIT_SIZE)
-                        digit = process_digit(digit)
-
-                        # The idea is to measure the distance from the borders of the
-                        # digit to the first non black pixels of the number, and then
-                        # try to allign the number. Width check is only done on the
-                        # very first race, since having a 1 minute start lap will break
-                        # this allignment algorithm.
-                        # This fixes small misallignment in different capture card outputs
-
-                        if not first_race:
-                            # Calculating the distance from the up and down sides
-                            dist_up = DIGIT_HEIGHT
-                            dist_down = DIGIT_HEIGHT
-                            for y in range(DIGIT_WIDTH):
-                                visited_up = False
-                                visited_down = False
-                                for x in range(DIGIT_HEIGHT):
-                                    if not visited_down and digit[DIGIT_HEIGHT - x - 1, y] != BLACK:
-                                        dist_down = min(dist_down, x)
-                                        visited_down = True
-
-                                    if not visited_up and digit[x, y] != BLACK:
-                                        dist_up = min(dist_up, x)
-                                        visited_up = True
-
-                                    if visited_down and visited_up:
-                                        break
-
-                            # Getting the maximum distance, i.e the side that needs
-                            # to be corrected
-                            temp = max(dist_up, dist_down)
-                            fixed_height = True
-                            # If the maximum distance is greater than this threadhold
-                            if temp > 2:
-                                # Adjust the height when cropping the digits
-                                if temp == dist_up:
-                                    HEIGHT_FIX = dist_up - 2
-                                else:
-                                    HEIGHT_FIX = 2 - dist_down
-
-                        # If it's the first race, do a width check.
-                        # Same code as for the up and down sides, except that this time
-                        # we calculate the average distance of the pixels, instead of using
-                        # the very first non black pixel as the total distance.
-
-                        # I used different algorithms for the sides because they proved to
-                        # be more effective after testing with multiple runs.
-                        if first_race:
-                            first_race = False
-
-                            dist_right = DIGIT_WIDTH
-                            dist_left = DIGIT_WIDTH
-                            valid_right = 0
-                            valid_left = 0
-
-                            # Ignoring pixels too close to the border, since they usually are
-                            # always black, which messes up with the average distance of the
-                            # pixels that represents the number
-
-                            for x in range(DIGIT_HEIGHT // 3, (DIGIT_HEIGHT * 2 // 3) + 1):
-                                visited_right = False
-                                visited_left = False
-                                for y in range(DIGIT_WIDTH // 2):
-                                    if not visited_left and digit[x, DIGIT_WIDTH - 1 - y] != BLACK:
-                                        dist_left += y
-                                        valid_left += 1
-                                        visited_left = True
-
-                                    if not visited_right and digit[x, y] != BLACK:
-                                        dist_right += y
-                                        valid_right += 1
-                                        visited_right = True
-
-                                    if visited_left and visited_right:
-                                        break
-
-                            # Calculating tyhe average distance
-                            dist_right = dist_right // valid_right
-                            dist_left = dist_left // valid_left
-
-                            if dist_right > 2:
-                                WIDTH_FIX = dist_right - 2
-                            elif dist_left > 2:
-                                WIDTH_FIX = 2 - dist_left
-
-                        row = in_game_time[26 * i + HEIGHT_FIX + ROW_COORD[version][2 * i] : 26 * i + HEIGHT_FIX + ROW_COORD[version][2 * i + 1], 0:]
-
-                        if fixed_height:
-                            rows.append(row)
-                            break
-
-                # List to store each predicted digit
-                lap_times = []
-                for i in range(3):
-                    for j in range(5):
-                        digit = rows[i][0:, WIDTH_FIX + DIGIT_COORD[j][version][0] : WIDTH_FIX + DIGIT_COORD[j][version][1]] 
-                        # Resizing each digit to make them bigger,
-                        # and also make sure that they will have the same size for the KNN input.
-                        digit = cv2.resize(digit, DIGIT_SIZE_HIGH)
-                        # Process the digit before predicting
-                        digit = process_digit(digit)
-                        # Predict the number and store it
-                        n = model.predict(np.reshape(digit, (1, digit.shape[0] * digit.shape[1])))
-                        lap_times.append(n[0])
-
-                # Storing final values
-                times.append(lap_times)
-                igt.append(in_game_time)
-
-        # Read new frame, apply transformations and check the status of the video
-        status, original_frame = video.read()
-        if status == False:
-            break
-        original_frame = original_frame[h1:h2, w1:w2]
-        frame = cv2.cvtColor(original_frame, cv2.COLOR_BGR2GRAY)
+            if observer is not None:
+                observer("races", 1)
+
+            # The alignment of the video is the median of the alignment of its races so far.
+            # Until a race is read, the pool is waited for so the races aren't read with their
+            # own measure. Realigned races move the estimate, so every previous race is waited
+            # for, which keeps the digits the same with any number of threads. The races are
+            # far apart, so the previous ones are usually read already
+            if pool is not None:
+                wait = len(width_estimates) == 0 or (realign and not defer_prediction)
+                collect_races(futures, times, distances, pending, width_estimates, defer_prediction, wait=wait)
+            WIDTH_FIX = race_alignment(in_game_time, version, width_estimates)
+
+            # Crop, align, process and predict the digits of the race, unless the predictions
+            # are deferred to the end of the video. The pool reads the race while the scan
+            # skips the timeout after it
+            if pool is not None:
+                futures.append(pool.submit(recognize_race, model, in_game_time, version, WIDTH_FIX, defer_prediction, realign, observer))
+            else:
+                race = recognize_race(model, in_game_time, version, WIDTH_FIX, defer_prediction, realign, observer)
+                store_race(race, times, distances, pending, width_estimates, defer_prediction)
+
+            # Storing final values
+            igt.append(in_game_time)
+            frames.append([flash_index, index])
+
+            # The next scan resumes on the frame after the race, where the timeout starts
+            start = index + 1
+            if checkpoint is not None:
+                state = {
+                    "index": start, "igt_found": igt_found, "width_estimates": width_estimates,
+                    "version": version, "version_margin": margin,
+                    "done": False, "igt": igt, "times": times,
+                    "distances": distances, "pending": pending, "frames": frames,
+                }
+                # The scan goes on without checkpoints if they can't be written
+                if not save_checkpoint(checkpoint, key, state):
+                    checkpoint = None
+
+            if igt_found == num_races:
+                break
 
-        # Resize to match pixel positions
-        original_frame = cv2.resize(original_frame, GAME_SIZE)
-        frame = cv2.resize(frame, GAME_SIZE)
+        # Stop decoding the rest of the video, then wait for the races still being read
+        scan.close()
+        collect_races(futures, times, distances, pending, width_estimates, defer_prediction, wait=True)
+    finally:
+        # An error or an interruption of the scan still releases the video and the threads,
+        # without reading the races that didn't start yet
+        scan.close()
+        if pool is not None:
+            for future in futures:
+                future.cancel()
+            pool.shutdown()
+
+    # The scan is complete, a restart only needs to read the checkpoint
+    if checkpoint is not None and not done:
+        state = {
+            "index": start, "igt_found": igt_found, "width_estimates": width_estimates,
+            "version": version, "version_margin": margin,
+            "done": True, "igt": igt, "times": times,
+            "distances": distances, "pending": pending, "frames": frames,
+        }
+        save_checkpoint(checkpoint, key, state)
+
+    # Predict the digits of every race in a single model call
+    if len(pending) > 0:
+        predictions, neighbor_distances = predict_digits(model, [digit for race_digits in pending for digit in race_digits], observer)
+        for i in range(len(pending)):
+            times.append(predictions[i * DIGITS_PER_IGT : (i + 1) * DIGITS_PER_IGT])
+            distances.append(neighbor_distances[i * DIGITS_PER_IGT : (i + 1) * DIGITS_PER_IGT])
+
+    if stats is not None:
+        stats["frames"] = frames
+    # Caching the result for the next time the video is opened
+    if cache_dir is not None:
+        store_result(result_key, {
+            "times": times, "igt": igt, "distances": distances, "frames": frames,
+            "version": version, "version_margin": margin,
+        }, cache_dir)
+
+    return times, igt, distances
+
+
+def stream_video(video, h1, h2, w1, w2, version, category, realign=False):
+    ''' Processes a live source of frames, yielding the result of each race as soon
+        as its in game time screen is recognized. Only the digits of the races are
+        kept, so the memory used doesn't grow with the length of the stream.
+        Each result is a dictionary with the number of the race, the frame where it
+        ended, its digits, the distances of the digits to their nearest neighbors
+        and the running total of the in game time.
+        @param video: frame source opened by open_stream(), released once the stream ends.
+        @param h1, h2, w1, w2: crop of the game in the frames.
+        @param version: index of the game region, None to detect it on the first race.
+        @param category: index of the run category, or a dictionary of custom settings,
+        the stream stops after its last race.
+        @param realign: set to True to read the races whose digits are far from the
+        model again, with the alignments measured on their own digits. '''
+
+    model = load_model()
+    settings = category_settings(category)
+    num_races = settings["races"]
+    width_estimates = []
+    times = []
 
-    close_video(video)
-    return times, igt
\ No newline at end of file
+    # A live stream may start anywhere, so there is no timeout at the start
+    detect = version is None
+    scan = scan_video(video, h1, h2, w1, w2, version, timeout=0, race_timeout=settings["timeout"], max_spacing=settings["max_spacing"])
+    try:
+        for flash_index, _, in_game_time in scan:
+
+            # Lock the region that reads the first race best, and the scan with it
+            if detect:
+                version, _, _ = detect_version(in_game_time, model)
+                in_game_time = trim_igt(in_game_time, version)
+                detect = not scan.send(version)
+
+            (lap_times, lap_distances), width_fix = recognize_race(model, in_game_time, version, race_alignment(in_game_time, version, width_estimates), False, realign)
+            width_estimates.append(width_fix)
+            times.append(lap_times)
+
+            hours, minutes, seconds, miliseconds = calculate_total(times)
+            yield {
+                "race": len(times),
+                "frame": flash_index,
+                "version": VERSIONS[version],
+                "digits": lap_times,
+                "distances": [float(distance) for distance in lap_distances[:, 0]],
+                "total": "%d:%02d:%02d.%02d" % (hours, minutes, seconds, miliseconds),
+            }
+
+            if len(times) == num_races:
+                break
+    finally:
+        scan.close()
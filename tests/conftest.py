@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+import os
+import pytest
+import sys
+
+# The modules of the program import each other from the src directory
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+from digitModel import COMPACT_MODEL_PATH, save_model
+from imageProcessing import DIGIT_SIZE
+from syntheticVideo import SyntheticRun, load_dataset, load_labels, write_run
+
+# Digits of the training set of the model
+DATA_PATH = os.path.join(SRC_DIR, "MachineLearning", "data.zip")
+LABELS_PATH = os.path.join(SRC_DIR, "MachineLearning", "labels.txt")
+# Races of the synthetic run scanned by the tests
+SYNTHETIC_RACES = 3
+
+
+def digit_variants(img, rng):
+    ''' The digit as it is, blurred, noisy and resized to the size of the model,
+        like the crops of capture cards of different qualities.
+        @param img: grayscale image of a CTR digit.
+        @param rng: numpy random generator of the noise. '''
+
+    noisy = np.clip(cv2.GaussianBlur(img, (3, 3), 0).astype(int) + rng.integers(-60, 60, img.shape), 0, 255).astype(np.uint8)
+
+    return {
+        "original": img,
+        "blurred": cv2.GaussianBlur(img, (5, 5), 0),
+        "noisy": noisy,
+        "noisy_small": cv2.resize(noisy, DIGIT_SIZE),
+    }
+
+
+@pytest.fixture(scope="session")
+def digits():
+    ''' Digits of the training set and their labels, in the order of their names. '''
+
+    return load_dataset(DATA_PATH), load_labels(LABELS_PATH)
+
+
+@pytest.fixture(scope="session")
+def digit_pictures(digits):
+    ''' Every digit of the training set in each of its variants, see digit_variants(),
+        as a dictionary of lists of pictures by variant. '''
+
+    rng = np.random.default_rng(0)
+    pictures = {}
+    for img in digits[0]:
+        for variant, picture in digit_variants(img, rng).items():
+            pictures.setdefault(variant, []).append(picture)
+
+    return pictures
+
+
+@pytest.fixture(scope="session")
+def model_dir(digits, tmp_path_factory):
+    ''' Directory with a compact model built from the training set, like
+        "train.py --compact" does, since the models aren't tracked. '''
+
+    directory = tmp_path_factory.mktemp("model")
+    X = np.array(digits[0])
+    save_model(str(directory / COMPACT_MODEL_PATH), X.reshape(len(X), -1), np.array(digits[1]), height=X.shape[1], width=X.shape[2])
+
+    return directory
+
+
+@pytest.fixture
+def workdir(model_dir, monkeypatch):
+    ''' Runs the test in the model directory, where load_model() finds the model. '''
+
+    monkeypatch.chdir(model_dir)
+
+    return model_dir
+
+
+@pytest.fixture(scope="session")
+def synthetic_run(tmp_path_factory):
+    ''' Synthetic run written as a video, returned with its SyntheticRun. '''
+
+    # The run reads the dataset relative to the src directory, like the scripts
+    cwd = os.getcwd()
+    os.chdir(SRC_DIR)
+    try:
+        run = SyntheticRun(races=SYNTHETIC_RACES)
+    finally:
+        os.chdir(cwd)
+    path = str(tmp_path_factory.mktemp("run") / "run.mp4")
+    write_run(run, path)
+
+    return run, path
@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import pytest
+import sklearn.neighbors as nb
+
+from digitModel import *
+from imageProcessing import DIGIT_SIZE_HIGH, process_digit
+
+
+@pytest.fixture(scope="module")
+def models(digits, tmp_path_factory):
+    ''' Compact model and KNeighborsClassifier trained with the same digits. '''
+
+    X = np.reshape(digits[0], (len(digits[0]), -1))
+    Y = np.array(digits[1])
+    file_path = str(tmp_path_factory.mktemp("model") / COMPACT_MODEL_PATH)
+    save_model(file_path, X, Y, height=digits[0][0].shape[0], width=digits[0][0].shape[1])
+
+    return load_compact_model(file_path), nb.KNeighborsClassifier().fit(X, Y)
+
+
+@pytest.mark.parametrize("variant", ["original", "blurred", "noisy", "noisy_small"])
+def test_compact_model_matches_sklearn(models, digits, digit_pictures, variant):
+    compact, knc = models
+    # The digits are resized to the size of the dataset, like videoProcessing does
+    pictures = [process_digit(cv2.resize(picture, DIGIT_SIZE_HIGH)) for picture in digit_pictures[variant]]
+    X = np.reshape(pictures, (len(pictures), -1))
+
+    distances, indices = compact.kneighbors(X)
+    expected_distances, expected_indices = knc.kneighbors(X)
+    np.testing.assert_allclose(distances, expected_distances)
+
+    # Neighbors at the same distance may be found in a different order,
+    # but every neighbor found must be as close as the one it replaced
+    dataset = np.reshape(digits[0], (len(digits[0]), -1)).astype(float)
+    for i, j in zip(*np.nonzero(indices != expected_indices)):
+        assert np.isclose(np.linalg.norm(dataset[indices[i, j]] - X[i]), expected_distances[i, j])
+
+    # Ties at the distance of the last neighbor can pick neighbors of other numbers,
+    # so the predictions match whenever both models found the same neighbors
+    same = (np.sort(indices, axis=1) == np.sort(expected_indices, axis=1)).all(axis=1)
+    np.testing.assert_array_equal(compact.predict(X[same]), knc.predict(X[same]))
@@ -0,0 +1,22 @@
+import pytest
+
+from frameSource import *
+
+
+class FailingReader(ThreadedVideoReader):
+    ''' Reader whose decoder fails while decoding the video. '''
+
+    def decode_frames(self):
+        raise RuntimeError("decoder failed")
+
+
+def test_threaded_reader_raises_decoder_errors(synthetic_run):
+    _, path = synthetic_run
+    reader = FailingReader(path)
+    try:
+        with pytest.raises(RuntimeError, match="decoder failed"):
+            reader.read()
+        # The video already ended, so the error is only raised once
+        assert reader.read() == (False, None)
+    finally:
+        reader.release()
@@ -0,0 +1,226 @@
+import cv2
+import numpy as np
+import pytest
+
+from imageProcessing import *
+
+
+def process_digit_reference(digit):
+    ''' Per-pixel implementation of process_digit, before it was vectorized.
+        @param digit: grayscale image of a CTR digit '''
+
+    digit = detect_edges_reference(digit)
+    digit = add_border_reference(digit)
+    digit = remove_noisy_areas_reference(digit)
+
+    return digit
+
+
+def detect_edges_reference(img):
+    ''' Reference per-pixel implementation of detect_edges.
+        @param img: image of the CTR digit '''
+
+    height, width = img.shape
+    # Get the average color of the grayscale image
+    color_mean = np.mean(img)
+    color_mean *= 1.05
+
+    # Loop every pixel
+    for i in range(height):
+        for j in range(width):
+            # Select the darkest pixels as edges and color them black
+            if img[i, j] >= color_mean:
+                img[i, j] = WHITE
+            else:
+                img[i, j] = BLACK
+
+    return img
+
+
+def add_border_reference(img):
+    ''' Reference per-pixel implementation of add_border.
+        @param img: image of the CTR digit '''
+
+    height, width = img.shape
+
+    # Calculating the mean distance of the border to the
+    # black pixels surrounding the number
+    left_mean = 0
+    right_mean = 0
+    # Number of valid black pixels detected
+    right_row = 0
+    left_row = 0
+
+    # Looping every height
+    # since we're starting with the right and left border
+    for i in range(height):
+        visited_left = False
+        visited_right = False
+
+        # Looping half of the width pixels to prevent
+        # detecting black pixels in case of the image having holes
+        # surrounding the edges of the number
+        for j in range(width // 2):
+
+            # If a black pixel is detected, j is its distance to the border
+            # Lock the loop from detecting further pixels
+            # by toogling the visited boolean
+            if not visited_right and img[i, width - 1 - j] == BLACK:
+                right_mean += j
+                right_row += 1
+                visited_right = True
+
+            if not visited_left and img[i, j] == BLACK:
+                left_mean += j
+                left_row += 1
+                visited_left = True
+
+            # If both blacks were found, we can go to the next height
+            if visited_left and visited_right:
+                break
+
+    # Same code as before, but now for the up and down sides
+    up_mean = 0
+    up_row = 0
+    down_mean = 0
+    down_row = 0
+    for i in range(width):
+        visited_up = False
+        visited_down = False
+
+        for j in range(height // 2):
+            if not visited_down and img[height - 1 - j, i] == BLACK:
+                down_mean += j
+                down_row += 1
+                visited_down = True
+
+            if not visited_up and img[j, i] == BLACK:
+                up_mean += j
+                up_row += 1
+                visited_up = True
+
+            if visited_down and visited_up:
+                break
+
+    # We're safe to assume that the entire rectangle from the border
+    # to the average value of the first black pixel is noise.
+    # Thus, we remove it by making the entire rectangle be black.
+
+    # Left and right sides
+    for i in range(height):
+        for j in range(max(right_mean // right_row, 1)):
+            img[i, width - 1 - j] = BLACK
+        for j in range(max(left_mean // left_row, 1)):
+            img[i, j] = BLACK
+
+    # Up and down sides
+    for i in range(width):
+        for j in range(max(down_mean // down_row, 1)):
+            img[height - 1 - j, i] = BLACK
+        for j in range(max(up_mean // up_row, 1)):
+            img[j, i] = BLACK
+
+    return img
+
+
+def remove_noisy_areas_reference(img):
+    ''' Reference per-pixel implementation of remove_noisy_areas.
+        @param img: image of the CTR digit.
+        @param size: size of the area. '''
+
+    height, width = img.shape
+
+    # Remove the smaller areas of the image. Default threshold is 150 pixels.
+    # Areas too small usually are just noise, so removing helps cleaning up the image,
+    # which helps predicting the right number.
+    areas = detect_colored_areas(img, WHITE, GRAY, BLACK)
+    for area in areas:
+        paint_colored_area(img, area[0], GRAY, WHITE)
+
+    # Dilate each white part of the picture. This helps witH glueing parts of the number
+    # which are separated by a few black pixels, and also removes a bit of remaining noise.
+    img = cv2.dilate(img, KERNEL, iterations=1)
+
+    # If the height is the height of a digit that will be used for prediction
+    if height != DIGIT_HEIGHT:
+
+        # Adding a black border to the image
+        for i in range(width):
+            img[0, i] = BLACK
+            img[height - 1, i] = BLACK
+        for i in range(height):
+            img[i, 0] = BLACK
+            img[i, width - 1] = BLACK
+
+        # Our dataset consists of CTR digits, which are unique and never changes.
+        # However, depending on the capture card quality, the alligment of the Y axis
+        # does change from video to video. So, in order to fix it and help getting a more
+        # accurate prediction, I'm alligning the number with the top of the picture.
+
+        # Variable to store the distance from the first WHITE pixel in the Y axis
+        fix_height = 0
+        # Looping every pixel, ignoring the border
+        for i in range(1, height):
+            found = False
+            for j in range(1, width - 1):
+
+                # Whenever you find a white pixel, the distance from where you start will be
+                # y = the current height - 1, since we ignore the border
+                if img[i, j] == WHITE:
+                    fix_height = i - 1
+                    found = True
+                    break
+
+            if found:
+                break
+
+        # If the distance from the first white pixel needs to be adjusted
+        if fix_height > 0:
+
+            # Move all pixels up, ignoring the border
+            for i in range(1, height - fix_height):
+                for j in range(1, width - 1):
+                    img[i, j] = img[i + fix_height, j]
+
+            # Erase the remaining pixels by painting them as BLACK
+            for i in range(height - fix_height, height):
+                for j in range(width):
+                    img[i, j] = BLACK
+
+    return img
+
+
+@pytest.mark.parametrize("variant", ["original", "blurred", "noisy", "noisy_small"])
+def test_process_digit_matches_reference(digit_pictures, variant):
+    for i, img in enumerate(digit_pictures[variant]):
+        expected = process_digit_reference(img.copy())
+        result = process_digit(img.copy())
+        assert result.dtype == expected.dtype, i
+        assert np.array_equal(result, expected), i
+
+
+def test_every_digit_is_loaded(digits):
+    assert len(digits[0]) == len(digits[1]) == 756
+
+
+def flood_fill_areas(img, diagonal):
+    ''' Removes the small white areas with the flood fill of detect_colored_areas,
+        painting the areas kept back to white like remove_noisy_areas used to.
+        @param img: binary picture with a black border.
+        @param diagonal: whether diagonal pixels are neighbors. '''
+
+    for area in detect_colored_areas(img, WHITE, GRAY, BLACK, diagonal=diagonal):
+        paint_colored_area(img, area[0], GRAY, WHITE, diagonal)
+
+    return img
+
+
+@pytest.mark.parametrize("variant", ["original", "blurred", "noisy", "noisy_small"])
+@pytest.mark.parametrize("diagonal", [True, False])
+def test_remove_small_areas_matches_flood_fill(digit_pictures, variant, diagonal):
+    for i, img in enumerate(digit_pictures[variant]):
+        # The areas are removed from the edges of the digit, inside its black border
+        img = add_border(detect_edges(img.copy()))
+        expected = flood_fill_areas(img.copy(), diagonal)
+        result = remove_small_areas(img.copy(), WHITE, BLACK, diagonal=diagonal)
+        assert np.array_equal(result, expected), i
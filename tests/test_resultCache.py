@@ -0,0 +1,93 @@
+import numpy as np
+import os
+import pytest
+
+from resultCache import *
+from videoProcessing import process_video
+
+
+def fake_result(seed=0):
+    ''' Result of a video with two races, with noisy pictures that PNG can't compress. '''
+
+    rng = np.random.default_rng(seed)
+    return {
+        "times": [[int(digit) for digit in rng.integers(0, 10, 15)] for _ in range(2)],
+        "igt": [rng.integers(0, 256, (76, 142), dtype=np.uint8) for _ in range(2)],
+        "distances": [rng.random((15, 5)) for _ in range(2)],
+        "frames": [[100, 110], [2300, 2310]],
+        "version": 0,
+        "version_margin": 0.5,
+    }
+
+
+def test_cached_result_is_reused(workdir, synthetic_run, tmp_path):
+    run, path = synthetic_run
+    width, height = run.size
+    category = {"name": "Custom", "races": run.races}
+    cache_dir = str(tmp_path / "cache")
+
+    stats = {}
+    times, igt, distances = process_video(path, 0, height, 0, width, run.version, category, None, stats=stats, cache_dir=cache_dir)
+    assert "cached" not in stats
+
+    stats = {}
+    cached_times, cached_igt, cached_distances = process_video(path, 0, height, 0, width, run.version, category, None, stats=stats, cache_dir=cache_dir)
+    assert stats["cached"]
+    assert cached_times == times == run.times
+    for picture, cached_picture in zip(igt, cached_igt):
+        np.testing.assert_array_equal(cached_picture, picture)
+    for race_distances, cached_race_distances in zip(distances, cached_distances):
+        np.testing.assert_allclose(cached_race_distances, race_distances)
+
+
+
+@pytest.mark.parametrize("options", [{"ffmpeg": True}, {"realign": True}])
+def test_result_of_other_options_is_not_reused(workdir, synthetic_run, tmp_path, options):
+    run, path = synthetic_run
+    width, height = run.size
+    category = {"name": "Custom", "races": run.races}
+    cache_dir = str(tmp_path / "cache")
+    process_video(path, 0, height, 0, width, run.version, category, None, cache_dir=cache_dir)
+
+    stats = {}
+    times, _, _ = process_video(path, 0, height, 0, width, run.version, category, None, stats=stats, cache_dir=cache_dir, **options)
+
+    assert "cached" not in stats
+    assert times == run.times
+
+def test_least_recently_used_result_is_evicted(workdir, tmp_path):
+    cache_dir = str(tmp_path)
+    result = fake_result()
+    store_result("a", result, cache_dir)
+    store_result("b", result, cache_dir)
+    # Older results than any result used from now on, "b" being the oldest
+    os.utime(os.path.join(cache_dir, "a"), (1000, 1000))
+    os.utime(os.path.join(cache_dir, "b"), (500, 500))
+
+    # Reading "a" makes "b" the least recently used result
+    assert load_result("a", cache_dir) is not None
+    store_result("c", result, cache_dir, max_size=2 * entry_size(os.path.join(cache_dir, "a")))
+
+    assert sorted(os.listdir(cache_dir)) == ["a", "c"]
+    assert load_result("b", cache_dir) is None
+
+
+def test_result_of_another_model_is_discarded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    with open(COMPACT_MODEL_PATH, "wb") as file:
+        file.write(b"model")
+    result = fake_result()
+    store_result("a", result, cache_dir)
+
+    cached = load_result("a", cache_dir)
+    assert cached["times"] == result["times"]
+    for picture, cached_picture in zip(result["igt"], cached["igt"]):
+        np.testing.assert_array_equal(cached_picture, picture)
+
+    # Training the model again changes its file
+    with open(COMPACT_MODEL_PATH, "wb") as file:
+        file.write(b"retrained model")
+
+    assert load_result("a", cache_dir) is None
+    assert not os.path.exists(os.path.join(cache_dir, "a"))
@@ -0,0 +1,90 @@
+import os
+import pytest
+
+from scanCheckpoint import *
+from videoProcessing import category_key, category_settings, process_video
+
+
+class Interruption(Exception):
+    ''' Interruption of the program in the middle of a scan. '''
+
+
+def race_counter(interrupt=None):
+    ''' Observer counting the races found, which interrupts the scan
+        once it finds more races than the given number.
+        @param interrupt: number of races found before the interruption, None to never interrupt. '''
+
+    found = []
+
+    def observer(event, value):
+        if event == "races":
+            found.append(value)
+            if interrupt is not None and len(found) > interrupt:
+                raise Interruption()
+
+    return observer, found
+
+
+def synthetic_category(run):
+    ''' Custom category with the number of races of the synthetic run. '''
+
+    return {"name": "Custom", "races": run.races}
+
+
+def test_resumed_scan_matches_full_scan(workdir, synthetic_run, tmp_path):
+    run, path = synthetic_run
+    width, height = run.size
+    category = synthetic_category(run)
+    checkpoint = str(tmp_path / "run.checkpoint.npz")
+
+    times, _, _ = process_video(path, 0, height, 0, width, run.version, category, None)
+
+    observer, _ = race_counter(interrupt=1)
+    with pytest.raises(Interruption):
+        process_video(path, 0, height, 0, width, run.version, category, None, checkpoint=checkpoint, observer=observer)
+    key = checkpoint_key(path, 0, height, 0, width, run.version, category_key(category_settings(category)), False)
+    assert load_checkpoint(checkpoint, key)["igt_found"] == 1
+
+    # Only the races after the checkpoint are scanned again
+    observer, found = race_counter()
+    resumed, _, _ = process_video(path, 0, height, 0, width, run.version, category, None, checkpoint=checkpoint, observer=observer)
+
+    assert len(found) == run.races - 1
+    assert resumed == times == run.times
+
+
+def test_unwritable_checkpoint_is_skipped(workdir, synthetic_run, tmp_path):
+    run, path = synthetic_run
+    width, height = run.size
+    # A file where the directory of the checkpoint should be
+    (tmp_path / "video.mp4").write_bytes(b"")
+    checkpoint = str(tmp_path / "video.mp4" / "run.checkpoint.npz")
+
+    times, _, _ = process_video(path, 0, height, 0, width, run.version, synthetic_category(run), None, checkpoint=checkpoint)
+
+    assert times == run.times
+    assert not os.path.exists(checkpoint)
+
+
+def test_checkpoint_path_is_named_after_the_video(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = checkpoint_path("run.mp4", str(tmp_path / "checkpoints"))
+
+    assert os.path.dirname(path) == str(tmp_path / "checkpoints")
+    assert path == checkpoint_path(str(tmp_path / "run.mp4"), str(tmp_path / "checkpoints"))
+    assert path != checkpoint_path("other.mp4", str(tmp_path / "checkpoints"))
+
+
+@pytest.mark.parametrize("options", [{"ffmpeg": True}, {"realign": True}])
+def test_checkpoint_of_other_options_is_not_resumed(synthetic_run, tmp_path, options):
+    run, path = synthetic_run
+    width, height = run.size
+    checkpoint = str(tmp_path / "run.checkpoint.npz")
+    state = {
+        "index": 100, "igt_found": 0, "width_estimates": [], "version": run.version, "version_margin": 0.0,
+        "done": False, "igt": [], "times": [], "distances": [], "pending": [], "frames": [],
+    }
+    assert save_checkpoint(checkpoint, checkpoint_key(path, 0, height, 0, width, run.version, "3,2100,None", False), state)
+
+    assert load_checkpoint(checkpoint, checkpoint_key(path, 0, height, 0, width, run.version, "3,2100,None", False))["index"] == 100
+    assert load_checkpoint(checkpoint, checkpoint_key(path, 0, height, 0, width, run.version, "3,2100,None", False, **options)) is None
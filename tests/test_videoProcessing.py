@@ -0,0 +1,62 @@
+import pytest
+
+from instrumentation import ProfileObserver
+from videoProcessing import *
+
+
+def scanned_races(races):
+    ''' Flash and last frames of the races yielded by a scan, with the pixels of their in game time.
+        @param races: generator returned by scan_video or scan_video_parallel. '''
+
+    return [(flash_index, last_index, in_game_time.tolist()) for flash_index, last_index, in_game_time in races]
+
+
+@pytest.mark.parametrize("workers", [2, 3, 5])
+def test_parallel_scan_matches_serial_scan(synthetic_run, workers):
+    run, path = synthetic_run
+    width, height = run.size
+
+    serial = scanned_races(scan_video(path, 0, height, 0, width, run.version, SKIP_SEEK))
+    parallel = scanned_races(scan_video_parallel(path, 0, height, 0, width, run.version, SKIP_SEEK, workers=workers))
+
+    assert [race[0] for race in serial] == run.flash_indices()
+    assert parallel == serial
+
+
+@pytest.mark.parametrize("stride", [2, SAMPLE_STRIDE, 32])
+@pytest.mark.parametrize("version", [0, None])
+def test_stride_scan_matches_dense_scan(synthetic_run, stride, version):
+    run, path = synthetic_run
+    width, height = run.size
+    dense_observer = ProfileObserver()
+    sparse_observer = ProfileObserver()
+
+    dense = scanned_races(scan_video(path, 0, height, 0, width, version, SKIP_SEEK, observer=dense_observer))
+    sparse = scanned_races(scan_video(path, 0, height, 0, width, version, SKIP_SEEK, observer=sparse_observer, stride=stride))
+
+    assert [race[0] for race in dense] == run.flash_indices()
+    assert sparse == dense
+    # Outside the races, only the samples are checked
+    assert sparse_observer.totals["rescans"] == run.races
+    assert sparse_observer.totals["samples"] < dense_observer.totals["frames_decoded"] // stride + 2 * FLASH_WINDOW * run.races
+
+
+def test_scan_switches_to_the_detected_region(synthetic_run):
+    run, path = synthetic_run
+    width, height = run.size
+    expected = scanned_races(scan_video(path, 0, height, 0, width, run.version))
+
+    scan = scan_video(path, 0, height, 0, width, None)
+    flash_index, last_index, in_game_time = next(scan)
+    assert in_game_time.shape == (igt_union()[1] - igt_union()[0], igt_union()[3] - igt_union()[2])
+    races = [(flash_index, last_index, trim_igt(in_game_time, run.version).tolist())]
+    assert scan.send(run.version) == True
+    races += scanned_races(scan)
+
+    assert races == expected
+
+
+def test_category_settings_take_the_defaults():
+    assert category_settings(0) == dict(CATEGORY_TABLE[0], **CATEGORY_DEFAULTS)
+    custom = category_settings({"name": "Single Cup", "max_spacing": 5000})
+    assert custom == {"name": "Single Cup", "races": 4, "timeout": TIMEOUT, "max_spacing": 5000}